@@ -20,6 +20,9 @@ setup(
         'requests',
         'python-dateutil'
     ],
+    extras_require={
+        'offline': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             'signalform-tools=signalform_tools.signalform:main',
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from typing import Tuple
+
+import requests
+from signalform_tools.preflight import count_events_by_ts
+from signalform_tools.preflight import get_session
+from signalform_tools.preflight import get_sfx_endpoint
+from signalform_tools.preflight import send_to_sfx
+
+
+BENCH_PROGRAM_TEXT = "detect(when(data('cpu.utilization').mean() > 90, lasting='5m')).publish('bench')"
+PERCENTILES = (50, 90, 99)
+
+
+def timed_preflight(program_text: str, start: int, stop: int, session: requests.Session) -> Tuple[float, bool]:
+    """Run a preflight request and parse its events like preflight does
+    :returns: (latency in seconds, whether the request succeeded)
+    """
+    begin = time.perf_counter()
+    try:
+        status_code, text = send_to_sfx(program_text, start, stop, session)
+    except requests.exceptions.RequestException:
+        return time.perf_counter() - begin, False
+    count_events_by_ts(text)
+    return time.perf_counter() - begin, status_code == 200
+
+
+def percentile(latencies: List[float], pct: int) -> float:
+    """Nearest-rank percentile of sorted latencies"""
+    return latencies[max(0, math.ceil(len(latencies) * pct / 100) - 1)]
+
+
+def bench_preflight_signalform(args):
+    if args.requests < 1 or args.concurrency < 1:
+        print('ERROR: --requests and --concurrency must be at least 1')
+        exit(1)
+    program_text = open(args.program).read() if args.program else BENCH_PROGRAM_TEXT
+    stop = int(time.time()) * 1000
+    start = stop - 60 * 60 * 1000
+
+    # one pooled connection per thread, so that requests reuse connections rather than measuring their setup
+    session = get_session(args.concurrency)
+    print(f'Sending {args.requests} preflight requests to {get_sfx_endpoint()}, {args.concurrency} at a time')
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(
+            lambda _: timed_preflight(program_text, start, stop, session), range(args.requests),
+        ))
+    elapsed = time.perf_counter() - begin
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    print(f'Requests: {len(results)} ({errors} errors) in {elapsed:.2f}s')
+    print(f'Throughput: {len(results) / elapsed:.1f} requests/sec')
+    print('Latency: ' + ' '.join(
+        [f'p{pct} {percentile(latencies, pct) * 1000:.1f}ms' for pct in PERCENTILES]
+        + [f'max {latencies[-1] * 1000:.1f}ms'],
+    ))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import itertools
+import random
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import List
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from signalform_tools.preflight import Event
+from signalform_tools.preflight import render_events
+from signalform_tools.preflight import SFX_PREFLIGHT_PATH
+
+
+CHUNK_SIZE = 8192
+
+
+def synthetic_events(start: int, stop: int, series: int, events: int) -> List[Event]:
+    """Spread triggered and resolved events evenly over the interval, for each time series"""
+    step = (stop - start) // (events + 1)
+    return [
+        Event(f"AAAAA{index:06X}", start + step * (n + 1), "anomalous" if n % 2 == 0 else "ok")
+        for index in range(series)
+        for n in range(events)
+    ]
+
+
+class FakePreflightServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, args) -> None:
+        super().__init__(address, FakePreflightHandler)
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.recorded = itertools.cycle([open(path).read() for path in args.replay]) if args.replay else None
+
+    def next_response(self, start: int, stop: int) -> str:
+        if self.recorded:
+            return next(self.recorded)
+        return render_events(synthetic_events(start, stop, self.args.series, self.args.events), start, stop)
+
+
+class FakePreflightHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self) -> None:
+        args = self.server.args
+        url = urlparse(self.path)
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep((args.latency + self.server.random.uniform(0, args.jitter)) / 1000)
+
+        if url.path != SFX_PREFLIGHT_PATH:
+            return self.reply(404, '{"message" : "Not Found"}')
+        if self.server.random.random() < args.error_rate:
+            return self.reply(args.error_status, '{"message" : "Injected error"}')
+        try:
+            query = parse_qs(url.query)
+            start, stop = int(query['start'][0]), int(query['stop'][0])
+        except (KeyError, ValueError):
+            return self.reply(400, '{"message" : "start and stop are required"}')
+        self.reply(200, self.server.next_response(start, stop))
+
+    def reply(self, status: int, text: str) -> None:
+        """Send the response, throttled to the configured throughput"""
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        throughput = self.server.args.throughput
+        for offset in range(0, len(body), CHUNK_SIZE):
+            chunk = body[offset:offset + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            if throughput:
+                time.sleep(len(chunk) / throughput)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if not self.server.args.quiet:
+            super().log_message(format, *args)
+
+
+def fake_preflight_signalform(args):
+    server = FakePreflightServer((args.host, args.port), args)
+    host, port = server.server_address[:2]
+    print(f'Serving fake SignalFlow preflight API, point preflight to it with SFX_ENDPOINT=http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+import datetime
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from signalform_tools.preflight import DetectorProgram
+from signalform_tools.preflight import Event
+from signalform_tools.preflight import Sender
+from signalform_tools.preflight import display_comparison
+from signalform_tools.preflight import extract_labels
+from signalform_tools.preflight import hash_program_text
+from signalform_tools.preflight import iter_events
+from signalform_tools.preflight import normalize_program_text
+from signalform_tools.preflight import render_events
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS programs (
+    hash TEXT PRIMARY KEY,
+    program_text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    label TEXT NOT NULL,
+    program_hash TEXT NOT NULL REFERENCES programs (hash),
+    PRIMARY KEY (label, program_hash)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created_at INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS detectors (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    program_hash TEXT NOT NULL REFERENCES programs (hash)
+);
+CREATE INDEX IF NOT EXISTS detectors_name ON detectors (name);
+CREATE INDEX IF NOT EXISTS detectors_program ON detectors (program_hash, run_id);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    program_hash TEXT NOT NULL REFERENCES programs (hash),
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    triggered INTEGER NOT NULL,
+    resolved INTEGER NOT NULL,
+    cached_from INTEGER REFERENCES results (id)
+);
+CREATE INDEX IF NOT EXISTS results_window ON results (program_hash, start, stop);
+CREATE TABLE IF NOT EXISTS events (
+    result_id INTEGER NOT NULL REFERENCES results (id),
+    ts_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_result ON events (result_id, timestamp);
+"""
+
+
+class History:
+    """Preflight results of past runs, in a SQLite database.
+
+    Results are stored along with their events, so that a later run over a window within an already evaluated one
+    can be answered from the database instead of SignalFx. This is an approximation: SignalFx evaluates a detector
+    from the start of the requested window, so conditions already ongoing at the start of a sub-window, e.g. with a
+    lasting duration, may fire at different times.
+    """
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # preflight requests are sent, and recorded, from several threads
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = Lock()
+        self.run_id: Optional[int] = None
+        self.source = ""
+        # number of requests answered from past results
+        self.reused = 0
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> "History":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.connection.close()
+
+    def start_run(self, source: str, start: int, stop: int) -> None:
+        """Record a preflight run
+        :param source: where results come from, only results of the same source are reused
+        """
+        with self.lock, self.connection:
+            self.run_id = self.connection.execute(
+                "INSERT INTO runs (created_at, source, start, stop) VALUES (?, ?, ?, ?)",
+                (int(time.time()), source, start, stop),
+            ).lastrowid
+        self.source = source
+
+    def add_program(self, program_text: str) -> str:
+        """Record a program text and its labels, must be called with the lock held
+        :returns: program text hash
+        """
+        program_hash = hash_program_text(program_text)
+        inserted = self.connection.execute(
+            "INSERT OR IGNORE INTO programs (hash, program_text) VALUES (?, ?)", (program_hash, program_text),
+        ).rowcount
+        if inserted:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO labels (label, program_hash) VALUES (?, ?)",
+                [(label, program_hash) for label in extract_labels(program_text)],
+            )
+        return program_hash
+
+    def observe(self, detectors: Iterable[DetectorProgram]) -> Iterator[DetectorProgram]:
+        """Record the detectors of the run as they are read"""
+        for detector in detectors:
+            with self.lock, self.connection:
+                program_hash = self.add_program(normalize_program_text(detector.program_text))
+                self.connection.execute(
+                    "INSERT INTO detectors (run_id, name, program_hash) VALUES (?, ?, ?)",
+                    (self.run_id, detector.name, program_hash),
+                )
+            yield detector
+
+    def sender(self, send: Sender, reuse: bool = False) -> Sender:
+        """Wrap a preflight backend to record its responses
+        :param reuse: answer from past results when possible, approximately
+        """
+        def send_with_history(program_text: str, start: int, stop: int) -> Tuple[int, str]:
+            cached = self.lookup(program_text, start, stop) if reuse else None
+            if cached is not None:
+                events = self.result_events(cached, start, stop)
+                self.record(program_text, start, stop, 200, events, cached_from=cached)
+                with self.lock:
+                    self.reused += 1
+                return 200, render_events(events, start, stop)
+            status_code, text = send(program_text, start, stop)
+            self.record(program_text, start, stop, status_code, list(iter_events(text)) if status_code == 200 else [])
+            return status_code, text
+
+        return send_with_history
+
+    def lookup(self, program_text: str, start: int, stop: int) -> Optional[int]:
+        """Find the latest successful result of the program over a window covering [start, stop]"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT results.id FROM results JOIN runs ON runs.id = results.run_id "
+                "WHERE results.program_hash = ? AND results.start <= ? AND results.stop >= ? "
+                "AND results.status = 200 AND results.cached_from IS NULL AND runs.source = ? "
+                "ORDER BY results.id DESC LIMIT 1",
+                (hash_program_text(program_text), start, stop, self.source),
+            ).fetchone()
+        return row[0] if row else None
+
+    def record(
+        self, program_text: str, start: int, stop: int, status_code: int, events: List[Event],
+        cached_from: Optional[int] = None,
+    ) -> None:
+        triggered = sum(1 for event in events if event.state == 'anomalous')
+        with self.lock, self.connection:
+            program_hash = self.add_program(program_text)
+            result_id = self.connection.execute(
+                "INSERT INTO results (run_id, program_hash, start, stop, status, triggered, resolved, cached_from) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.run_id, program_hash, start, stop, status_code, triggered, len(events) - triggered, cached_from),
+            ).lastrowid
+            if cached_from is None:
+                self.connection.executemany(
+                    "INSERT INTO events (result_id, ts_id, timestamp, state) VALUES (?, ?, ?, ?)",
+                    [(result_id, *event) for event in events],
+                )
+
+    def result_events(self, result_id: int, start: int, stop: int) -> List[Event]:
+        """Events of a result within [start, stop], following results answered from past ones"""
+        with self.lock:
+            result_id = self.connection.execute(
+                "SELECT coalesce(cached_from, id) FROM results WHERE id = ?", (result_id,),
+            ).fetchone()[0]
+            return [Event(*row) for row in self.connection.execute(
+                "SELECT ts_id, timestamp, state FROM events WHERE result_id = ? AND timestamp BETWEEN ? AND ? "
+                "ORDER BY timestamp",
+                (result_id, start, stop),
+            )]
+
+    def trend(self, name: Optional[str], label: Optional[str], last: int) -> List[Tuple]:
+        """Latest successful results of the selected detectors, oldest first
+        :param name: detector name, over all the versions of its program text
+        :param label: published label, exact or glob pattern
+        :returns: [(result id, run date, start, stop, program hash, triggered, resolved, cached, detector names)]
+        """
+        conditions, params = ["results.status = 200"], []
+        if name:
+            conditions.append("results.program_hash IN (SELECT program_hash FROM detectors WHERE name = ?)")
+            params.append(name)
+        if label:
+            conditions.append("results.program_hash IN (SELECT program_hash FROM labels WHERE label GLOB ?)")
+            params.append(label)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT results.id, runs.created_at, results.start, results.stop, results.program_hash, "
+                "results.triggered, results.resolved, results.cached_from IS NOT NULL, "
+                "(SELECT group_concat(name, ', ') FROM detectors "
+                " WHERE detectors.run_id = results.run_id AND detectors.program_hash = results.program_hash) "
+                "FROM results JOIN runs ON runs.id = results.run_id "
+                f"WHERE {' AND '.join(conditions)} ORDER BY results.id DESC LIMIT ?",
+                (*params, last),
+            ).fetchall()
+        return rows[::-1]
+
+
+def detector_names(row: Tuple) -> Set[str]:
+    """Detector names of a trend row"""
+    return set(row[-1].split(", ")) if row[-1] else set()
+
+
+def latest_pair(rows: List[Tuple]) -> Optional[Tuple[Tuple, Tuple]]:
+    """The two latest results of the same detector in trend rows, the latest one being the last row, so that
+    results of unrelated detectors are never compared. Results are related by detector name, or by program text
+    for results recorded outside of a run of named detectors.
+    :returns: (older row, latest row), None when the latest detector has no earlier result
+    """
+    if not rows:
+        return None
+    latest = rows[-1]
+    names = detector_names(latest)
+    for row in reversed(rows[:-1]):
+        if names & detector_names(row) if names else row[4] == latest[4]:
+            return row, latest
+    return None
+
+
+def format_time(timestamp_ms: int) -> str:
+    return datetime.datetime.fromtimestamp(timestamp_ms / 1000).strftime('%Y-%m-%d %H:%M')
+
+
+def history_signalform(args):
+    if not os.path.exists(args.db):
+        print(f'No preflight history in {args.db}, record some with preflight --history')
+        return
+    with History(args.db) as history:
+        rows = history.trend(args.detector, args.label, args.last)
+        if not rows:
+            print('No recorded results')
+            return
+
+        print(f'{"run at":<18} {"window":<35} {"program":<10} {"triggered":>9} {"resolved":>9}  detectors')
+        for _, created_at, start, stop, program_hash, triggered, resolved, cached, names in rows:
+            window = f'{format_time(start)} - {format_time(stop)}'
+            names = f'{names or "-"}{" (reused)" if cached else ""}'
+            print(f'{format_time(created_at * 1000):<18} {window:<35} {program_hash[:8]:<10} '
+                  f'{triggered:>9} {resolved:>9}  {names}')
+
+        pair = latest_pair(rows) if args.diff else None
+        if args.diff and pair is None:
+            print(f'\nNo earlier result of {rows[-1][-1] or rows[-1][4][:8]} to diff against')
+        elif pair:
+            print()
+            (old_id, _, old_start, old_stop, *_), (new_id, _, new_start, new_stop, *_, names) = pair
+            display_comparison(
+                names or 'results',
+                render_events(history.result_events(old_id, old_start, old_stop), old_start, old_stop),
+                render_events(history.result_events(new_id, new_start, new_stop), new_start, new_stop),
+            )
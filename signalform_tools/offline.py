@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+import ast
+import base64
+import csv
+import fnmatch
+import hashlib
+import inspect
+import re
+import warnings
+from collections import defaultdict
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from signalform_tools.preflight import Event
+from signalform_tools.preflight import render_events
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+DURATION_MULT: Dict[str, int] = {
+    "ms": 1,
+    "s": 1000,
+    "m": 60 * 1000,
+    "h": 60 * 60 * 1000,
+    "d": 24 * 60 * 60 * 1000,
+    "w": 7 * 24 * 60 * 60 * 1000,
+}
+DURATION_RE = re.compile(r"^\s*(\d+)\s*(ms|s|m|h|d|w)\s*$")
+METRIC_COLUMNS = ("metric", "sf_metric")
+NUMERIC_COLUMNS = ("timestamp", "value")
+MAX_GRID_CELLS = 10 ** 8
+AGGREGATIONS: Dict[str, Callable] = {
+    "mean": lambda values: np.nanmean(values, axis=0),
+    "sum": lambda values: np.where(np.isnan(values).all(axis=0), np.nan, np.nansum(values, axis=0)),
+    "max": lambda values: np.nanmax(values, axis=0),
+    "min": lambda values: np.nanmin(values, axis=0),
+    "count": lambda values: (~np.isnan(values)).sum(axis=0).astype(float),
+}
+COMPARISONS: Dict[type, Callable] = {
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+}
+
+
+class UnsupportedSignalFlow(ValueError):
+    pass
+
+
+class Stream(NamedTuple):
+    keys: List[Dict[str, str]]  # dimensions of each time series
+    values: Any  # time series x time grid array of values, NaN when missing
+
+
+class Condition(NamedTuple):
+    keys: List[Dict[str, str]]
+    mask: Any  # time series x time grid boolean array
+    known: Any  # where the mask is known, i.e. not compared against missing values
+
+
+class Filter(NamedTuple):
+    matches: Callable[[Dict[str, str]], bool]
+
+
+class Detect(NamedTuple):
+    condition: Condition
+    lasting: int
+
+
+def parse_duration(duration: str) -> int:
+    """Parse SignalFlow durations (e.g. '5m') into milliseconds"""
+    match = DURATION_RE.match(duration)
+    if not match:
+        raise UnsupportedSignalFlow(f"Unsupported duration: {duration}")
+    return int(match.group(1)) * DURATION_MULT[match.group(2)]
+
+
+def ts_id(label: str, dimensions: Dict[str, str]) -> str:
+    """Stable SignalFx-looking time series id"""
+    digest = hashlib.sha1(repr((label, sorted(dimensions.items()))).encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest[:8]).decode("ascii").rstrip("=")
+
+
+def read_columns(filename: str) -> Dict[str, Any]:
+    """Read exported metrics column by column, one data point per row
+    :returns: {column: array}, timestamp and value as floats with NaN when missing, dimensions as strings
+    :raise: ValueError
+    """
+    if filename.endswith(".parquet"):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Error: reading Parquet files requires pyarrow")
+        table = pyarrow.parquet.read_table(filename)
+        return {
+            name: column.cast(pyarrow.float64()).to_numpy(zero_copy_only=False) if name in NUMERIC_COLUMNS
+            else column.cast(pyarrow.string()).fill_null("").to_numpy(zero_copy_only=False).astype(str)
+            for name, column in zip(table.column_names, table.columns)
+        }
+    try:
+        with open(filename, newline="") as data_file:
+            reader = csv.reader(data_file)
+            header = next(reader, [])
+            cells = np.array(list(reader), dtype=str).reshape(-1, len(header))
+    except OSError as e:
+        raise ValueError(f"Error: cannot read {filename}: {e.strerror}") from e
+    except ValueError as e:  # rows of different lengths
+        raise ValueError(f"Error: malformed CSV in {filename}") from e
+    columns = {}
+    for position, name in enumerate(header):
+        column = cells[:, position]
+        if name in NUMERIC_COLUMNS:
+            try:
+                column = np.where(column == "", "nan", column).astype(float)
+            except ValueError as e:
+                raise ValueError(f"Error: non numeric {name} in {filename}: {e}") from e
+        columns[name] = column
+    return columns
+
+
+def most_common_steps(series: Any, timestamps: Any) -> Any:
+    """Most common interval between consecutive points of each time series
+    :param series: time series of each point, points sorted by time series and timestamp
+    :returns: one step per time series with at least two distinct timestamps
+    """
+    steps = np.diff(timestamps)
+    same_series = (np.diff(series) == 0) & (steps > 0)
+    pairs, counts = np.unique(np.stack([series[1:][same_series], steps[same_series]], axis=1), axis=0,
+                              return_counts=True)
+    if not len(pairs):
+        return pairs[:, 1]
+    pairs = pairs[np.lexsort((-counts, pairs[:, 0]))]
+    first = np.concatenate([[True], np.diff(pairs[:, 0]) != 0])
+    return pairs[first, 1]
+
+
+class TimeSeriesStore:
+    """Exported time series, rolled up on a common time grid and indexed by metric.
+
+    Rows need a timestamp (epoch seconds or milliseconds), a metric and a value column, all other columns are
+    dimensions. Like SignalFx, points are rolled up (averaged) into buckets of the coarsest resolution of the time
+    series, the most common interval between their points, unless a resolution is given.
+    """
+
+    def __init__(self, filename: str, resolution: Optional[int] = None) -> None:
+        if np is None:
+            raise ValueError("Error: offline preflight requires numpy, install signalform-tools[offline]")
+        columns = read_columns(filename)
+        metric_column = next((column for column in METRIC_COLUMNS if column in columns), None)
+        if metric_column is None or not all(column in columns for column in NUMERIC_COLUMNS):
+            raise ValueError("Error: exported metrics need timestamp, metric and value columns")
+        timestamps, values = columns.pop("timestamp"), columns.pop("value")
+        known = ~np.isnan(timestamps)
+        if not known.any():
+            raise ValueError(f"Error: no data points in {filename}")
+        timestamps = np.where(timestamps < 1e11, timestamps * 1000, timestamps)[known].astype(np.int64)
+        values = values[known]
+
+        # time series are the distinct combinations of metric and dimension values
+        names = [metric_column] + sorted(column for column in columns if column != metric_column)
+        uniques, codes = zip(*(np.unique(columns[name][known], return_inverse=True) for name in names))
+        series_codes, row_series = np.unique(np.stack([code.reshape(-1) for code in codes], axis=1), axis=0,
+                                             return_inverse=True)
+        row_series = row_series.reshape(-1)
+
+        if resolution is None:
+            order = np.lexsort((timestamps, row_series))
+            steps = most_common_steps(row_series[order], timestamps[order])
+            resolution = int(steps.max()) if len(steps) else 1000
+        self.resolution = resolution
+        self.origin = int(timestamps.min()) // resolution * resolution
+        width = (int(timestamps.max()) - self.origin) // resolution + 1
+        if len(series_codes) * width > MAX_GRID_CELLS:
+            raise ValueError(f"Error: {len(series_codes)} time series over {width} points at a {resolution}ms "
+                             "resolution do not fit in memory, use a coarser --resolution")
+
+        cells = row_series * width + (timestamps - self.origin) // resolution
+        present = ~np.isnan(values)
+        sums = np.bincount(cells[present], weights=values[present], minlength=len(series_codes) * width)
+        counts = np.bincount(cells[present], minlength=len(series_codes) * width)
+        with np.errstate(invalid="ignore"):
+            self.grid = (sums / counts).reshape(len(series_codes), width)
+
+        self.metrics: Dict[str, Tuple[List[Dict[str, str]], List[int]]] = defaultdict(lambda: ([], []))
+        for index, code in enumerate(series_codes):
+            metric, *dimensions = (str(unique[value]) for unique, value in zip(uniques, code))
+            keys, indices = self.metrics[metric]
+            keys.append(dict(
+                {name: value for name, value in zip(names[1:], dimensions) if value != ""}, sf_metric=metric,
+            ))
+            indices.append(index)
+
+    def columns(self, start: int, stop: int) -> slice:
+        """Grid columns within [start, stop)"""
+        first = max(0, -(-(start - self.origin) // self.resolution))
+        last = max(first, -(-(stop - self.origin) // self.resolution))
+        return slice(first, last)
+
+    def timestamp(self, column: int) -> int:
+        return int(self.origin + column * self.resolution)
+
+    def data(self, metric: str, series_filter: Filter, columns: slice) -> Stream:
+        keys, indices = self.metrics.get(metric, ([], []))
+        selected = [i for i, key in enumerate(keys) if series_filter.matches(key)]
+        values = self.grid[[indices[i] for i in selected], columns]
+        return Stream([keys[i] for i in selected], values)
+
+
+class Evaluator:
+    """Interpret a SignalFlow program over a time window of the store, with NumPy operations over all time series
+    at once. Only a subset of SignalFlow is supported:
+        data('metric', filter=filter('key', 'value', ...) and not filter(...))
+        .mean(by=[...]), .sum(by=[...]), .max(by=[...]), .min(by=[...]), .count(by=[...])
+        detect(when(stream > threshold, lasting='5m')).publish('label'), with >, >=, <, <=, and, or
+    """
+
+    def __init__(self, store: TimeSeriesStore, start: int, stop: int) -> None:
+        self.program_text = ""
+        self.store = store
+        self.columns = store.columns(start, stop)
+        self.names: Dict[str, Any] = {}
+        self.published: List[Tuple[str, Detect]] = []
+
+    def run(self, program_text: str) -> None:
+        self.program_text = program_text
+        try:
+            module = ast.parse(program_text)
+        except SyntaxError as e:
+            raise UnsupportedSignalFlow(f"Invalid program text: {e}") from e
+        for statement in module.body:
+            if isinstance(statement, ast.Assign) and len(statement.targets) == 1 \
+                    and isinstance(statement.targets[0], ast.Name):
+                self.names[statement.targets[0].id] = self.eval(statement.value)
+            elif isinstance(statement, ast.Expr):
+                self.eval(statement.value)
+            else:
+                raise UnsupportedSignalFlow(f"Unsupported statement: {self.source(statement)}")
+
+    def eval(self, node: ast.AST) -> Any:
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.List):
+            return [self.eval(element) for element in node.elts]
+        if isinstance(node, ast.Name):
+            if node.id not in self.names:
+                raise UnsupportedSignalFlow(f"Unknown name: {node.id}")
+            return self.names[node.id]
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return self.minus(self.eval(node.operand))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return self.negate(self.eval(node.operand))
+        if isinstance(node, ast.BoolOp):
+            return self.combine(node.op, [self.eval(value) for value in node.values])
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in COMPARISONS:
+            return self.compare(COMPARISONS[type(node.ops[0])], self.eval(node.left), self.eval(node.comparators[0]))
+        if isinstance(node, ast.Call):
+            return self.call(node)
+        raise UnsupportedSignalFlow(f"Unsupported expression: {self.source(node)}")
+
+    def call(self, node: ast.Call) -> Any:
+        args = [self.eval(arg) for arg in node.args]
+        kwargs = {keyword.arg: self.eval(keyword.value) for keyword in node.keywords}
+        if isinstance(node.func, ast.Name):
+            function = getattr(self, f"call_{node.func.id}", None)
+            if function:
+                try:
+                    inspect.signature(function).bind(*args, **kwargs)
+                except TypeError as e:
+                    raise UnsupportedSignalFlow(f"Unsupported call: {self.source(node)}: {e}") from e
+                return function(*args, **kwargs)
+        elif isinstance(node.func, ast.Attribute):
+            target = self.eval(node.func.value)
+            if isinstance(target, Stream) and node.func.attr in AGGREGATIONS and not args \
+                    and set(kwargs) <= {"by"}:
+                return self.aggregate(target, node.func.attr, kwargs.get("by"))
+            if isinstance(target, (Stream, Detect)) and node.func.attr == "publish":
+                label = args[0] if args else kwargs.get("label")
+                if not isinstance(label, str):
+                    raise UnsupportedSignalFlow(f"publish() needs a label: {self.source(node)}")
+                if isinstance(target, Detect):
+                    self.published.append((label, target))
+                return target
+        raise UnsupportedSignalFlow(f"Unsupported call: {self.source(node)}")
+
+    def source(self, node: ast.AST) -> str:
+        return ast.get_source_segment(self.program_text, node) or type(node).__name__
+
+    def call_data(self, metric: str, filter: Filter = None, **kwargs: Any) -> Stream:
+        unsupported = set(kwargs) - {"rollup", "extrapolation", "maxExtrapolations", "resolution"}
+        if unsupported:
+            raise UnsupportedSignalFlow(f"Unsupported data() arguments: {', '.join(sorted(unsupported))}")
+        if not isinstance(metric, str) or not isinstance(filter, (Filter, type(None))):
+            raise UnsupportedSignalFlow("data() needs a metric name and a filter")
+        return self.store.data(metric, filter or Filter(lambda dimensions: True), self.columns)
+
+    def call_filter(self, key: str, *values: str) -> Filter:
+        if not isinstance(key, str):
+            raise UnsupportedSignalFlow("filter() needs a dimension name")
+        return Filter(lambda dimensions: key in dimensions and any(
+            fnmatch.fnmatchcase(dimensions[key], str(value)) for value in values
+        ))
+
+    def call_when(self, condition: Condition, lasting: str = None) -> Detect:
+        if not isinstance(condition, Condition):
+            raise UnsupportedSignalFlow("when() needs a comparison")
+        if lasting is not None and not isinstance(lasting, str):
+            raise UnsupportedSignalFlow(f"Unsupported duration: {lasting!r}")
+        return Detect(condition, parse_duration(lasting) if lasting else 0)
+
+    def call_detect(self, on: Detect) -> Detect:
+        if not isinstance(on, Detect):
+            raise UnsupportedSignalFlow("detect() needs a when() condition")
+        return on
+
+    def aggregate(self, stream: Stream, aggregation: str, by: Any) -> Stream:
+        by = [by] if isinstance(by, str) else by or []
+        if not isinstance(by, list) or not all(isinstance(dimension, str) for dimension in by):
+            raise UnsupportedSignalFlow(f"Unsupported {aggregation}() dimensions: {by!r}")
+        groups: Dict[Tuple[str, ...], List[int]] = defaultdict(list)
+        for position, key in enumerate(stream.keys):
+            groups[tuple(key.get(dimension, "") for dimension in by)].append(position)
+        if not groups:
+            return Stream([], stream.values[:0])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)  # all-NaN slices
+            values = np.stack([AGGREGATIONS[aggregation](stream.values[positions]) for positions in groups.values()])
+        return Stream([dict(zip(by, group)) for group in groups], values)
+
+    def compare(self, comparison: Callable, left: Any, right: Any) -> Condition:
+        streams = [operand for operand in (left, right) if isinstance(operand, Stream)]
+        if not streams:
+            raise UnsupportedSignalFlow("Comparisons need a stream")
+        keys = max((stream.keys for stream in streams), key=len)
+        left, right = self.array(left, len(keys)), self.array(right, len(keys))
+        # comparisons with missing values (NaN) are false, and unknown
+        with np.errstate(invalid="ignore"):
+            mask, known = np.broadcast_arrays(comparison(left, right), ~np.isnan(left) & ~np.isnan(right))
+        return Condition(keys, mask, known)
+
+    def array(self, value: Any, series: int) -> Any:
+        if isinstance(value, Stream):
+            if len(value.keys) not in (1, series):
+                raise UnsupportedSignalFlow("Comparing streams with different time series")
+            return value.values
+        if isinstance(value, (int, float)):
+            return np.float64(value)
+        raise UnsupportedSignalFlow(f"Unsupported operand: {value!r}")
+
+    def minus(self, value: Any) -> Any:
+        if isinstance(value, Stream):
+            return Stream(value.keys, -value.values)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return -value
+        raise UnsupportedSignalFlow(f"Unsupported operand: {value!r}")
+
+    def negate(self, value: Any) -> Any:
+        if isinstance(value, Filter):
+            return Filter(lambda dimensions: not value.matches(dimensions))
+        raise UnsupportedSignalFlow("not is only supported on filters")
+
+    def combine(self, operator: ast.boolop, values: List[Any]) -> Any:
+        is_and = isinstance(operator, ast.And)
+        if all(isinstance(value, Filter) for value in values):
+            combine = all if is_and else any
+            return Filter(lambda dimensions: combine(value.matches(dimensions) for value in values))
+        if all(isinstance(value, Condition) for value in values):
+            keys = max((value.keys for value in values), key=len)
+            if any(len(value.keys) not in (1, len(keys)) for value in values):
+                raise UnsupportedSignalFlow("Combining conditions on different time series")
+            masks = np.broadcast_arrays(*(value.mask for value in values))
+            knowns = np.broadcast_arrays(*(value.known for value in values))
+            all_known = np.logical_and.reduce(knowns)
+            if is_and:
+                # a known false operand is enough to know the result
+                mask = np.logical_and.reduce(masks)
+                known = all_known | np.logical_or.reduce([k & ~m for k, m in zip(knowns, masks)])
+            else:
+                mask = np.logical_or.reduce(masks)
+                known = all_known | mask
+            return Condition(keys, mask, known)
+        raise UnsupportedSignalFlow("and/or are only supported between filters or between conditions")
+
+    def events(self) -> List[Event]:
+        """Events fired by the published detectors, in time order"""
+        events = []
+        for label, detect in self.published:
+            mask, known = (np.atleast_2d(array) for array in (detect.condition.mask, detect.condition.known))
+            lasting = max(1, -(-detect.lasting // self.store.resolution))
+            steps = np.arange(mask.shape[1])
+            # gaps in the data keep the last known state, rather than interrupting the lasting duration
+            last_known = np.maximum.accumulate(np.where(known, steps, -1), axis=1)
+            mask = np.take_along_axis(mask, np.maximum(last_known, 0), axis=1) & (last_known >= 0)
+            # number of consecutive true values ending at each point in time
+            last_false = np.maximum.accumulate(np.where(mask, -1, steps), axis=1)
+            anomalous = (steps - last_false) >= lasting
+            edges = np.diff(anomalous.astype(np.int8), axis=1, prepend=0)
+            for series, column in zip(*np.nonzero(edges)):
+                events.append(Event(
+                    ts_id(label, detect.condition.keys[series]),
+                    self.store.timestamp(self.columns.start + column),
+                    "anomalous" if edges[series, column] > 0 else "ok",
+                ))
+        return sorted(events, key=lambda event: event.timestamp)
+
+
+class OfflinePreflight:
+    """Stand-in for preflight.send_to_sfx, answering preflight requests from exported time series"""
+
+    def __init__(self, filename: str, resolution: Optional[int] = None) -> None:
+        self.store = TimeSeriesStore(filename, resolution)
+
+    def __call__(self, program_text: str, start: int, stop: int) -> Tuple[int, str]:
+        evaluator = Evaluator(self.store, start, stop)
+        try:
+            evaluator.run(program_text)
+        except UnsupportedSignalFlow as e:
+            return 400, f'{{"message" : "{e}"}}'
+        return 200, render_events(evaluator.events(), start, stop)
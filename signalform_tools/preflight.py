@@ -1,22 +1,54 @@
 # -*- coding: utf-8 -*-
 import codecs
 import datetime
+import fnmatch
+import hashlib
+import itertools
 import json
 import os
 import re
 import time
+from collections import Counter
+from collections import defaultdict
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Set
 from typing import Tuple
 
 import dateutil.parser
 import requests
-from signalform_tools.utils import download_tfstate
-
-
-SFX_ENDPOINT = 'https://stream.signalfx.com/v2/signalflow/preflight?'
+import requests.adapters
+from signalform_tools.utils import iter_tfstate_resources
+from signalform_tools.utils import read_tfstate
+from signalform_tools.utils import stream_tfstate
+from signalform_tools.validate import Detector
+from signalform_tools.validate import list_filenames
+from signalform_tools.validate import parse_resources
+from signalform_tools.validate import strip_comments
+
+
+SFX_ENDPOINT = 'https://stream.signalfx.com'
+SFX_PREFLIGHT_PATH = '/v2/signalflow/preflight'
 SYSTEM_CONF_PATH = "/etc/signalfx.conf"
 HOME_CONF_SUFFIX = "/.signalfx.conf"
+SFX_MAX_WORKERS = 8
+PUBLISH_LABEL_RE = re.compile(r"""\.publish\(\s*(?:label\s*=\s*)?(?P<quote>['"])(?P<label>.*?)(?P=quote)""")
+MESSAGE_SEPARATOR_RE = re.compile(r'\n\s*\n')
+EVENT_TS_ID_RE = re.compile(r'"tsId"\s*:\s*"([^"]+)"')
+EVENT_STATE_RE = re.compile(r'"(anomalous|ok)"')
+EVENT_TIMESTAMP_RE = re.compile(r'"timestampMs"\s*:\s*(\d+)')
+NUMBER_RE = re.compile(r'^-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?$')
+SWEEP_RE = re.compile(r'^\s*(?P<literal>[^@=\s]+)\s*(?:@\s*(?P<occurrence>\d+)\s*)?=(?P<values>.*)$')
 
 # see https://docs.signalfx.com/en/latest/reference/analytics-docs/how-choose-data-resolution.html#data-retention-policies  # noqa
 SFX_RETENTION_DAYS = 8
@@ -29,65 +61,123 @@ SFX_TIME_MULT: Dict[str, int] = {
 
 
 def get_sfx_token() -> str:
-    sfx_token = read_conf(SYSTEM_CONF_PATH)
-    sfx_token = read_conf("".join((os.path.expanduser("~"), HOME_CONF_SUFFIX))) or sfx_token
-    return os.getenv('SFX_TOKEN', sfx_token)
+    return get_sfx_setting("auth_token", 'SFX_TOKEN', "")
+
+
+def get_sfx_endpoint() -> str:
+    """SignalFlow API endpoint, can point to a local stand-in server (see fake-preflight)"""
+    return get_sfx_setting("endpoint", 'SFX_ENDPOINT', SFX_ENDPOINT).rstrip("/")
+
 
+def get_sfx_setting(key: str, env_var: str, default: str) -> str:
+    """Read a setting from the environment, the user config or the system config, in this order"""
+    value = read_conf(SYSTEM_CONF_PATH, key) or default
+    value = read_conf("".join((os.path.expanduser("~"), HOME_CONF_SUFFIX)), key) or value
+    return os.getenv(env_var, value)
 
-def read_conf(filename: str) -> str:
+
+def read_conf(filename: str, key: str = "auth_token") -> str:
     if os.path.exists(filename):
         with open(filename) as conf:
             configs = json.loads(conf.read())
-            return configs.get("auth_token", "")
+            return configs.get(key, "")
     return ""
 
 
-def extract_program_text(filename: str) -> List[str]:
+class DetectorProgram(NamedTuple):
+    name: str
+    program_text: str
+
+
+class Event(NamedTuple):
+    ts_id: str
+    timestamp: int
+    state: str
+
+
+def extract_program_text(filename: str) -> List[DetectorProgram]:
     """If configs passed in are from terraform.tfstate process as json
     else use regex to parse tf_plan
     :param filename: config file to read from
     """
+    if filename.endswith('.tfstate'):
+        # same parser as for remote states, which reads the resources of every module
+        return list(extract_detectors(iter_tfstate_resources(read_tfstate(filename))))
     with open(filename) as conf:
-        if filename.endswith('.tfstate'):
-            configs = json.loads(conf.read())
-            program_text = []
-            resources = configs['modules'][0]['resources']
-            for resource in resources:
-                pattern = re.compile("signalform_detector.*")
-                if pattern.match(resource) is not None:
-                    program_text.append(
-                        re.sub(r'\n +', '\n', resources[resource]['primary']['attributes']['program_text']),
-                    )
-            return program_text
-        else:
-            configs = conf.read()
-            pattern = re.compile(r'program_text:.+(?:=>)?\s+\"(.+)\"')
-            return [re.sub(r'\\n +', '\n', pattern_match) for pattern_match in re.findall(pattern, configs)]
-
-
-def send_to_sfx(program_text: str, start: int, stop: int) -> (int, str):
+        configs = conf.read()
+        pattern = re.compile(r'program_text:.+(?:=>)?\s+\"(.+)\"')
+        return [
+            DetectorProgram(f'detector #{position}', re.sub(r'\\n +', '\n', pattern_match))
+            for position, pattern_match in enumerate(re.findall(pattern, configs))
+        ]
+
+
+def extract_detectors(resources: Iterable[Tuple[str, Dict[str, Any]]]) -> Iterator[DetectorProgram]:
+    """Extract detectors out of terraform state resources
+    :param resources: (resource key, resource) pairs
+    """
+    pattern = re.compile("signalform_detector.*")
+    for key, resource in resources:
+        if pattern.match(key) is not None:
+            yield DetectorProgram(
+                key.split('.', 1)[1],
+                re.sub(r'\n +', '\n', resource['primary']['attributes']['program_text']),
+            )
+
+
+def normalize_program_text(program_text: str) -> str:
+    """Decode escape sequences and drop trailing whitespace and blank lines, which SignalFlow ignores"""
+    lines = (line.rstrip() for line in codecs.decode(program_text, 'unicode_escape').splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def hash_program_text(program_text: str) -> str:
+    return hashlib.sha256(program_text.encode('utf-8')).hexdigest()
+
+
+def send_to_sfx(
+    program_text: str, start: int, stop: int, session: Optional[requests.Session] = None,
+) -> (int, str):
     """Send a POST request to the preflight API and parse results
     :param program_text: detector config in SignalFlow language
     :param start: start time to query from
     :param stop: stop time to query until
+    :param session: HTTP session to send the request with, the shared one by default
     :returns: (response status code, response text)
     """
     query_params = f'start={start}&stop={stop}'
-    url = SFX_ENDPOINT + query_params
+    url = f'{get_sfx_endpoint()}{SFX_PREFLIGHT_PATH}?{query_params}'
     headers = {'Content-Type': 'text/plain', 'X-SF-Token': get_sfx_token()}
-    resp = requests.post(url, headers=headers, data=program_text)
+    resp = (session or get_session()).post(url, headers=headers, data=program_text)
     return resp.status_code, resp.text
 
 
-def extract_events(text: str) -> (List[str], List[str]):
-    """Extracts event ids from SignalFx's response.
+@lru_cache(maxsize=None)
+def get_session(pool_maxsize: int = SFX_MAX_WORKERS) -> requests.Session:
+    """HTTP session pooling connections to the SignalFlow API across requests and threads
+    :param pool_maxsize: connections kept open, at least the number of threads sending requests
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
-    :param text: response text
-    :returns: (triggered alerts ids list, resolved alert ids list)
+
+Sender = Callable[[str, int, int], Tuple[int, str]]
+
+
+def send_all_to_sfx(
+    program_texts: Iterable[str], start: int, stop: int, send: Sender = send_to_sfx,
+) -> Dict[str, Tuple[int, str]]:
+    """Preflight program texts concurrently over the same interval
+    :param send: preflight backend, send_to_sfx or an offline stand-in
+    :returns: {program text: (response status code, response text)}
     """
-    alert_ids = re.findall(r'"anomalous"(?:.+\n.+)+"tsId"\s:\s"(.+)"', text)
-    clear_ids = re.findall(r'"ok"(?:.+\n.+)+"tsId"\s:\s"(.+)"', text)
-    return alert_ids, clear_ids
+    program_texts = list(dict.fromkeys(program_texts))
+    with ThreadPoolExecutor(max_workers=SFX_MAX_WORKERS) as executor:
+        responses = executor.map(lambda program_text: send(program_text, start, stop), program_texts)
+        return dict(zip(program_texts, responses))
 
 
 def display_events(text: str) -> None:
@@ -95,10 +185,57 @@ def display_events(text: str) -> None:
 
     :param text: response text
     """
-    alert_ids, clear_ids = extract_events(text)
+    triggered, resolved = count_events_by_ts(text)
+
+    print(f'Expected number of triggered alerts: {sum(triggered.values())}')
+    print(f'Expected number of resolved alerts: {sum(resolved.values())}\n')
+
+
+def count_events_by_ts(text: str) -> Tuple[Counter, Counter]:
+    """Count fired and resolved events of each time series, one SignalFlow message at a time.
+
+    :param text: response text
+    :returns: (triggered alerts by tsId, resolved alerts by tsId)
+    """
+    triggered: Counter = Counter()
+    resolved: Counter = Counter()
+    for event in iter_events(text):
+        events = triggered if event.state == 'anomalous' else resolved
+        events[event.ts_id] += 1
+    return triggered, resolved
 
-    print(f'Expected number of triggered alerts: {sum(text.count(id) for id in alert_ids)}')
-    print(f'Expected number of resolved alerts: {sum(text.count(id) for id in clear_ids)}\n')
+
+def iter_events(text: str) -> Iterator[Event]:
+    """Parse fired and resolved events out of the SignalFx response, one SignalFlow message at a time.
+
+    :param text: response text
+    """
+    for message in MESSAGE_SEPARATOR_RE.split(text):
+        ts_id = EVENT_TS_ID_RE.search(message)
+        state = EVENT_STATE_RE.search(message)
+        if ts_id and state:
+            timestamp = EVENT_TIMESTAMP_RE.search(message)
+            yield Event(ts_id.group(1), int(timestamp.group(1)) if timestamp else 0, state.group(1))
+
+
+def render_message(kind: str, message: Dict[str, Any]) -> str:
+    """Render a SignalFlow message the way the streaming API sends it"""
+    body = json.dumps(message, indent=2, separators=(',', ' : '))
+    return "".join((f"event: {kind}\n", *(f"data: {line}\n" for line in body.splitlines()), "\n"))
+
+
+def render_events(events: Iterable[Event], start: int, stop: int) -> str:
+    """Render a full preflight response firing the given detector events, the inverse of iter_events"""
+    messages = [render_message("control-message", {"event": "STREAM_START", "timestampMs": start})]
+    for event in events:
+        messages.append(render_message("event", {
+            "type": "event",
+            "properties": {"is": event.state, "sf_resolutionMs": 1000},
+            "tsId": event.ts_id,
+            "timestampMs": event.timestamp,
+        }))
+    messages.append(render_message("control-message", {"event": "END_OF_CHANNEL", "timestampMs": stop}))
+    return "".join(messages)
 
 
 def parse_sfx_now(input_time: str) -> int:
@@ -182,34 +319,354 @@ def interpret_interval(args) -> Tuple[int, int]:
         exit(1)
 
     retention_end = int((datetime.datetime.now() - datetime.timedelta(days=SFX_RETENTION_DAYS)).timestamp() * 1000)
-    if start < retention_end:
+    if start < retention_end and not args.offline:
         print(f'WARNING: start time is past the highest resolution data retention period ({SFX_RETENTION_DAYS} days). '
               'Fired events may differ from what has actually happened in the past.')
 
     return start, stop
 
 
-def preflight(filename, start, stop, label):
-    detectors = extract_program_text(filename)
-    for detector in detectors:
-        if label in detector or label == 'ALL':
-            print(f'Program Text in Detector:\n{detector}')
-            status_code, text = send_to_sfx(codecs.decode(detector, 'unicode_escape'), start, stop)
+def extract_labels(program_text: str) -> Set[str]:
+    """Extract the labels published by a detector, ignoring commented out code
+    :param program_text: detector config in SignalFlow language
+    """
+    code = "\n".join(strip_comments(line) for line in program_text.splitlines())
+    return {match.group("label") for match in PUBLISH_LABEL_RE.finditer(code)}
+
+
+class LabelIndex:
+    """Detectors indexed by the labels they publish. Label patterns are resolved once per distinct label, and
+    detectors can be added as they are read, e.g. while the state is being downloaded.
+    """
+
+    def __init__(self, patterns: List[str]) -> None:
+        """:param patterns: exact labels or glob patterns"""
+        self.patterns = patterns
+        # label -> positions of the detectors publishing it
+        self.positions: Dict[str, List[int]] = defaultdict(list)
+        # label -> patterns matching it
+        self.matching: Dict[str, Set[str]] = {}
+
+    def add(self, position: int, detector: DetectorProgram) -> bool:
+        """Index a detector
+        :returns: whether the detector publishes a label matching one of the patterns
+        """
+        selected = False
+        for label in extract_labels(codecs.decode(detector.program_text, 'unicode_escape')):
+            self.positions[label].append(position)
+            if label not in self.matching:
+                self.matching[label] = {pattern for pattern in self.patterns if fnmatch.fnmatchcase(label, pattern)}
+            selected = selected or bool(self.matching[label])
+        return selected
+
+    def selected(self) -> List[int]:
+        """:returns: sorted positions of the detectors publishing a matching label, each listed once"""
+        return sorted(set(chain.from_iterable(
+            positions for label, positions in self.positions.items() if self.matching[label]
+        )))
+
+    def warn_unmatched(self) -> None:
+        matched = set(chain.from_iterable(self.matching.values()))
+        for pattern in self.patterns:
+            if pattern not in matched:
+                print(f'WARNING: no detector publishes a label matching {pattern}')
+
+
+def select_detectors(detectors: List[DetectorProgram], patterns: List[str]) -> List[DetectorProgram]:
+    """Select the detectors publishing a label matching any of the patterns
+    :param patterns: exact labels or glob patterns
+    """
+    index = LabelIndex(patterns)
+    for position, detector in enumerate(detectors):
+        index.add(position, detector)
+    index.warn_unmatched()
+    return [detectors[position] for position in index.selected()]
+
+
+def preflight(
+    detectors: Iterable[DetectorProgram], start: int, stop: int, labels: Optional[List[str]],
+    send: Sender = send_to_sfx, keep_going: bool = False,
+) -> None:
+    """Preflight detectors as they come in, so that requests overlap with reading the state.
+    Detectors stamped out of the same template are only sent once.
+    :param keep_going: report failed requests and carry on with the other detectors, rather than stopping
+    """
+    index = LabelIndex(labels) if labels and 'ALL' not in labels else None
+    # program text hash -> (program text, detector names, pending response)
+    requests_sent: Dict[str, Tuple[str, List[str], Future]] = {}
+    with ThreadPoolExecutor(max_workers=SFX_MAX_WORKERS) as executor:
+        for position, detector in enumerate(detectors):
+            if index and not index.add(position, detector):
+                continue
+            program_text = normalize_program_text(detector.program_text)
+            digest = hash_program_text(program_text)
+            if digest not in requests_sent:
+                requests_sent[digest] = (program_text, [], executor.submit(send, program_text, start, stop))
+            requests_sent[digest][1].append(detector.name)
+
+        if index:
+            index.warn_unmatched()
+        failed: List[str] = []
+        for program_text, names, response in requests_sent.values():
+            print(f'Program Text in Detector:\n{program_text}')
+            print(f'Detectors: {", ".join(names)}')
+            status_code, text = response.result()
             if status_code != 200:
                 print(f'ERROR: Received Response:\n {text}\n')
+                if keep_going:
+                    failed.extend(names)
+                    continue
+                for pending in requests_sent.values():
+                    pending[2].cancel()
                 return
             display_events(text)
+        if failed:
+            print(f'WARNING: {len(failed)} detectors could not be preflighted: {", ".join(failed)}')
+
+
+def extract_candidates(path: str) -> List[DetectorProgram]:
+    """Extract detectors from terraform configurations, with the validate parser
+    :param path: terraform file or directory of terraform files
+    """
+    filenames = list_filenames(path) if os.path.isdir(path) else [path]
+    candidates = []
+    for filename in filenames:
+        with open(filename) as tf_conf:
+            candidates.extend(
+                DetectorProgram(resource.name, resource.program_text)
+                for resource in parse_resources(tf_conf, {'signalform_detector': Detector})
+            )
+    return candidates
+
+
+def display_comparison(name: str, deployed: Optional[str], candidate: str) -> None:
+    """Display per time series deltas of triggered and resolved events between two responses
+
+    :param deployed: response text for the deployed detector, None if it isn't deployed yet
+    :param candidate: response text for the candidate detector
+    """
+    deployed_triggered, deployed_resolved = count_events_by_ts(deployed or '')
+    candidate_triggered, candidate_resolved = count_events_by_ts(candidate)
+    ts_ids = sorted(set(chain(deployed_triggered, deployed_resolved, candidate_triggered, candidate_resolved)))
+    status = 'new' if deployed is None else 'changed'
+
+    def delta(old: int, new: int) -> str:
+        return f'{old} -> {new} ({new - old:+d})'
+
+    print(f'Detector {name} ({status}):')
+    print(f'  {"tsId":<24} {"triggered":<22} resolved')
+    for ts_id in ts_ids:
+        triggered = delta(deployed_triggered[ts_id], candidate_triggered[ts_id])
+        resolved = delta(deployed_resolved[ts_id], candidate_resolved[ts_id])
+        print(f'  {ts_id:<24} {triggered:<22} {resolved}')
+    triggered = delta(sum(deployed_triggered.values()), sum(candidate_triggered.values()))
+    resolved = delta(sum(deployed_resolved.values()), sum(candidate_resolved.values()))
+    print(f'  {"Total":<24} {triggered:<22} {resolved}\n')
+
+
+def compare(
+    deployed: Iterable[DetectorProgram], path: str, start: int, stop: int, labels: Optional[List[str]],
+    send: Sender = send_to_sfx, keep_going: bool = False,
+):
+    """Preflight candidate detectors from terraform configurations along with their deployed version from the
+    state, and compare the events they fire
+    :param keep_going: report detectors whose requests failed and compare the others, rather than stopping
+    """
+    deployed = list(deployed)
+    candidates = extract_candidates(path)
+    if labels and 'ALL' not in labels:
+        deployed = select_detectors(deployed, labels)
+        candidates = select_detectors(candidates, labels)
+
+    deployed_texts = {detector.name: normalize_program_text(detector.program_text) for detector in deployed}
+    candidate_texts = {detector.name: normalize_program_text(detector.program_text) for detector in candidates}
+    names = [name for name, text in candidate_texts.items() if deployed_texts.get(name) != text]
+    unchanged = len(candidate_texts) - len(names)
+    print(f'{len(names)} detectors changed, {unchanged} unchanged\n')
+
+    program_texts = [candidate_texts[name] for name in names]
+    program_texts += [deployed_texts[name] for name in names if name in deployed_texts]
+    responses = send_all_to_sfx(program_texts, start, stop, send)
+    if not keep_going:
+        for status_code, text in responses.values():
+            if status_code != 200:
+                print(f'ERROR: Received Response:\n {text}\n')
+                return
+
+    for name in names:
+        deployed_text = deployed_texts.get(name)
+        requested = [candidate_texts[name]] + ([deployed_text] if deployed_text is not None else [])
+        errors = [responses[text][1] for text in requested if responses[text][0] != 200]
+        if errors:
+            print(f'Detector {name} (error):\n {errors[0]}\n')
+            continue
+        display_comparison(
+            name,
+            responses[deployed_text][1] if deployed_text is not None else None,
+            responses[candidate_texts[name]][1],
+        )
+
+
+class Sweep(NamedTuple):
+    literal: str
+    occurrence: Optional[int]  # 1-based, None when the literal appears once
+    values: List[str]
+
+    def __str__(self) -> str:
+        return self.literal if self.occurrence is None else f'{self.literal}@{self.occurrence}'
+
+
+def parse_sweep(sweep: str) -> Sweep:
+    """Parse a sweep parameter, e.g. 90=80,85,90,95, or 5@2=5,10 for the second occurrence of 5
+    :raise: ValueError
+    """
+    match = SWEEP_RE.match(sweep)
+    values = [value.strip() for value in match.group('values').split(',') if value.strip()] if match else []
+    if not match or not NUMBER_RE.match(match.group('literal')) or not values \
+            or not all(NUMBER_RE.match(value) for value in values):
+        raise ValueError(f'ERROR: invalid sweep {sweep}, expected a numeric literal and values, e.g. 90=80,85,90')
+    occurrence = int(match.group('occurrence')) if match.group('occurrence') else None
+    return Sweep(match.group('literal'), occurrence, values)
+
+
+def locate_literal(program_text: str, sweep: Sweep) -> Tuple[int, int]:
+    """Find the position of a numeric literal, or of the number of a duration (e.g. lasting='5m'), leaving alone
+    numbers merely containing it (e.g. 900 for 90) and numbers in other strings
+    :returns: (start, end) offsets in the program text
+    :raise: ValueError
+    """
+    pattern = re.compile(rf'''(?<![\w.]){re.escape(sweep.literal)}(?=(?:ms|[smhdw])['"]|[^\w.'"]|$)''')
+    positions = [match.span() for match in pattern.finditer(program_text)]
+    if not positions:
+        raise ValueError(f'ERROR: {sweep.literal} does not appear in the program text')
+    if sweep.occurrence is None:
+        if len(positions) > 1:
+            raise ValueError(f'ERROR: {sweep.literal} appears {len(positions)} times in the program text, pick one, '
+                             f'e.g. {sweep.literal}@1=...')
+        return positions[0]
+    if not 1 <= sweep.occurrence <= len(positions):
+        raise ValueError(f'ERROR: {sweep.literal} only appears {len(positions)} times in the program text')
+    return positions[sweep.occurrence - 1]
+
+
+def replace_literals(program_text: str, positions: List[Tuple[int, int]], values: Iterable[str]) -> str:
+    """Replace the literals at the given positions of the original program text"""
+    for (start, end), value in sorted(zip(positions, values), reverse=True):
+        program_text = program_text[:start] + value + program_text[end:]
+    return program_text
+
+
+def sweep(
+    detectors: Iterable[DetectorProgram], sweeps: List[Sweep], start: int, stop: int,
+    labels: Optional[List[str]], send: Sender = send_to_sfx, keep_going: bool = False,
+) -> None:
+    """Preflight variants of a detector over a grid of values for its numeric literals, and tabulate the events
+    each variant fires
+    :param keep_going: report failed variants and tabulate the others, rather than stopping
+    :raise: ValueError
+    """
+    if not labels or 'ALL' in labels:
+        raise ValueError('ERROR: --sweep needs --label to select the detector to tune')
+    detectors = select_detectors(list(detectors), labels)
+    program_texts = {normalize_program_text(detector.program_text) for detector in detectors}
+    if len(program_texts) != 1:
+        names = ", ".join(detector.name for detector in detectors) or "none"
+        raise ValueError(f'ERROR: --sweep needs --label to select exactly one detector, selected: {names}')
+    program_text = program_texts.pop()
+
+    # located once on the original text, so that values of a sweep are never rewritten by the next one
+    positions = [locate_literal(program_text, grid) for grid in sweeps]
+    if len(set(positions)) != len(positions):
+        raise ValueError('ERROR: several sweeps replace the same literal')
+    variants = {
+        values: replace_literals(program_text, positions, values)
+        for values in itertools.product(*(grid.values for grid in sweeps))
+    }
+    print(f'Program Text in Detector:\n{program_text}')
+    print(f'Detectors: {", ".join(detector.name for detector in detectors)}')
+    print(f'Sweeping {len(variants)} variants\n')
+
+    responses = send_all_to_sfx(variants.values(), start, stop, send)
+    for values, variant in list(variants.items()):
+        status_code, text = responses[variant]
+        if status_code != 200:
+            print(f'ERROR: Received Response for {", ".join(values)}:\n {text}\n')
+            if not keep_going:
+                return
+            del variants[values]
+    if not variants:
+        return
+
+    columns = [str(grid) for grid in sweeps] + ['triggered', 'resolved', 'series']
+    width = max(12, *(len(column) + 2 for column in columns))
+    print("".join(f'{column:<{width}}' for column in columns).rstrip())
+    for values, variant in variants.items():
+        triggered, resolved = count_events_by_ts(responses[variant][1])
+        row = [*values, sum(triggered.values()), sum(resolved.values()), len(triggered)]
+        print("".join(f'{str(cell):<{width}}' for cell in row).rstrip())
+    print()
+
+
+def get_sender(args) -> Sender:
+    """Preflight against the SignalFlow API, or locally against exported metrics with --offline
+    :raise: ValueError
+    """
+    if args.offline:
+        from signalform_tools.offline import OfflinePreflight  # imports numpy
+        from signalform_tools.offline import parse_duration
+        return OfflinePreflight(args.offline, parse_duration(args.resolution) if args.resolution else None)
+    if args.resolution:
+        raise ValueError('ERROR: --resolution only applies to --offline')
+    return send_to_sfx
+
+
+def get_source(args) -> str:
+    """Where preflight results come from, results recorded in the history are only reused for the same source"""
+    if args.offline:
+        source = f'offline:{os.path.abspath(args.offline)}@{int(os.path.getmtime(args.offline))}'
+        return f'{source}/{args.resolution}' if args.resolution else source
+    return get_sfx_endpoint()
+
+
+def run_preflight(args, detectors: Iterable[DetectorProgram], start: int, stop: int) -> None:
+    if args.sweep and args.compare:
+        raise ValueError('ERROR: --sweep and --compare cannot be used together')
+    send = get_sender(args)
+    if args.history:
+        from signalform_tools.history import History
+        with History(args.history) as history:
+            history.start_run(get_source(args), start, stop)
+            dispatch_preflight(args, history.observe(detectors), start, stop, history.sender(send, args.reuse))
+            if history.reused:
+                print(f'NOTE: {history.reused} results were answered from the history instead of SignalFx. They are '
+                      'approximate, e.g. for detectors already firing at the start of the window.')
+    else:
+        dispatch_preflight(args, detectors, start, stop, send)
+
+
+def dispatch_preflight(args, detectors: Iterable[DetectorProgram], start: int, stop: int, send: Sender) -> None:
+    # offline, detectors outside of the supported SignalFlow subset are reported without stopping the others
+    keep_going = bool(args.offline)
+    if args.sweep:
+        sweep(detectors, [parse_sweep(grid) for grid in args.sweep], start, stop, args.label, send, keep_going)
+    elif args.compare:
+        compare(detectors, args.compare, start, stop, args.label, send, keep_going)
+    else:
+        preflight(detectors, start, stop, args.label, send, keep_going)
 
 
 def preflight_signalform(args):
     start, stop = interpret_interval(args)
 
     if args.file:
-        preflight(args.file, start, stop, args.label)
+        try:
+            run_preflight(args, extract_program_text(args.file), start, stop)
+        except ValueError as err:
+            print(err.args[0])
     elif args.remote:
         try:
-            with download_tfstate():
-                preflight("/".join((os.getcwd(), "terraform.tfstate")), start, stop, args.label)
+            # detectors are sent as soon as they are parsed out of the state being downloaded
+            run_preflight(args, extract_detectors(iter_tfstate_resources(stream_tfstate())), start, stop)
         except ValueError as err:
             print(err.args[0])
     else:
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import socketserver
+
+from signalform_tools.utils import send_socket_request
+from signalform_tools.validate import validate_request
+
+
+class ValidationHandler(socketserver.StreamRequestHandler):
+    """Answer newline delimited JSON validation requests, see validate.validate_request"""
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                response = validate_request(json.loads(line))
+            except (ValueError, TypeError, KeyError) as err:
+                response = {"warnings": [], "errors": [{"filename": "<request>", "error": f"Bad request: {err}"}]}
+            except Exception as err:  # e.g. a bug in a plugin rule, the client still needs an answer
+                response = {"warnings": [], "errors": [{"filename": "<request>", "error": f"Server error: {err!r}"}]}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+def serve_signalform(args):
+    if os.path.exists(args.socket):
+        if send_socket_request(args.socket, {}) is not None:
+            print(f"Error: a server is already listening on {args.socket}")
+            exit(1)
+        os.remove(args.socket)
+
+    server = socketserver.ThreadingUnixStreamServer(args.socket, ValidationHandler)
+    server.daemon_threads = True
+    os.chmod(args.socket, 0o600)
+    print(f"Serving validation requests on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
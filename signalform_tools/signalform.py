@@ -1,11 +1,19 @@
 # -*- coding: utf8 -*-
 import argparse
+import importlib
 import os
 
 from signalform_tools.__about__ import __version__
-from signalform_tools.preflight import preflight_signalform
-from signalform_tools.show import show_signalform
-from signalform_tools.validate import validate_signalform
+from signalform_tools.utils import DEFAULT_HISTORY_PATH
+from signalform_tools.utils import DEFAULT_SOCKET_PATH
+
+
+def command(module, function):
+    """Import the module of a command only when it runs, so that e.g. validate doesn't pay for boto3 and requests"""
+    def run(args):
+        return getattr(importlib.import_module(module), function)(args)
+
+    return run
 
 
 def parse_args():
@@ -25,11 +33,40 @@ def parse_args():
         'validate',
         help='validate help',
         description='Validate resources inside one or more directories.')
-    parser_validate.add_argument('filenames', nargs='*')
+    parser_validate.add_argument('filenames', nargs='*', help='files to validate, - reads a file from stdin')
     parser_validate.add_argument('--dir',
                                  help='directory to validate',
                                  default=os.getcwd())
-    parser_validate.set_defaults(func=validate_signalform)
+    parser_validate.add_argument('--since',
+                                 help='only validate files in the directory changed since this git ref, untracked '
+                                      'files included',
+                                 metavar='REF')
+    parser_validate.add_argument('--state',
+                                 help='validate the resources of a terraform state or of `terraform show -json` '
+                                      'output instead of configuration files',
+                                 action='append',
+                                 metavar='FILE')
+    parser_validate.add_argument('--socket',
+                                 help='socket of the validation server, used when it is running',
+                                 default=DEFAULT_SOCKET_PATH)
+    parser_validate.add_argument('--no-server',
+                                 help='always validate in process',
+                                 action='store_true',
+                                 default=False)
+    parser_validate.add_argument('--rule-stats',
+                                 help='report call counts and time spent per rule, validating in process',
+                                 action='store_true',
+                                 default=False)
+    parser_validate.set_defaults(func=command('signalform_tools.validate', 'validate_signalform'))
+
+    parser_serve = subparsers.add_parser(
+        'serve',
+        help='serve help',
+        description='Keep a validation server running, so validate calls skip startup costs.')
+    parser_serve.add_argument('--socket',
+                              help='socket to listen on',
+                              default=DEFAULT_SOCKET_PATH)
+    parser_serve.set_defaults(func=command('signalform_tools.server', 'serve_signalform'))
 
     parser_preflight = subparsers.add_parser(
         'preflight',
@@ -40,7 +77,9 @@ def parse_args():
     group.add_argument('-r', '--remote', action='store_true', default=False, help='Use remote state')
     parser_preflight.add_argument(
         '--label',
-        help='Specific detect label to test, checks all in the current folder by default',
+        help='Detect labels to test, either exact labels or glob patterns. Checks all in the current folder by '
+             'default',
+        nargs='+',
         type=str,
     )
     parser_preflight.add_argument(
@@ -55,7 +94,60 @@ def parse_args():
              'a date or a UNIX epoch timestamp in seconds or milliseconds',
         type=str,
     )
-    parser_preflight.set_defaults(func=preflight_signalform)
+    parser_preflight.add_argument(
+        '--compare',
+        help='Compare the events fired by the deployed detectors with the ones fired by the detectors in terraform '
+             'configurations, either a file or a directory (the current one by default)',
+        nargs='?',
+        const=os.getcwd(),
+        metavar='PATH',
+    )
+    parser_preflight.add_argument(
+        '--offline',
+        help='Evaluate simple threshold detectors locally against exported metrics (CSV, or Parquet with pyarrow) '
+             'instead of calling the SignalFlow API. Requires numpy',
+        metavar='DATA',
+    )
+    parser_preflight.add_argument(
+        '--resolution',
+        help='With --offline, roll up exported metrics at this resolution, e.g. 1m, instead of the coarsest '
+             'interval between the points of their time series',
+        metavar='DURATION',
+    )
+    parser_preflight.add_argument(
+        '--sweep',
+        help='Tune the detector selected with --label: preflight its variants with a numeric literal of the program '
+             'text replaced by each of the values, e.g. 90=80,85,90,95, and tabulate the events they fire. Use '
+             'LITERAL@N=VALUES for the Nth occurrence of a literal appearing several times. Repeat to sweep several '
+             'literals over all their combinations',
+        action='append',
+        metavar='LITERAL=VALUES',
+    )
+    parser_preflight.add_argument(
+        '--history',
+        help='Record the run in a local database, see the history command',
+        nargs='?',
+        const=DEFAULT_HISTORY_PATH,
+        metavar='DB',
+    )
+    parser_preflight.add_argument('--reuse', action='store_true', default=False,
+                                  help='With --history, answer requests for windows within already recorded ones '
+                                       'from the history instead of SignalFx. Results are approximate')
+    parser_preflight.set_defaults(func=command('signalform_tools.preflight', 'preflight_signalform'))
+
+    parser_history = subparsers.add_parser(
+        'history',
+        help='history help',
+        description='Show how the events expected from detectors changed over preflight runs recorded with '
+                    'preflight --history.')
+    parser_history.add_argument('--db', default=DEFAULT_HISTORY_PATH, help='history database')
+    parser_history.add_argument('--detector', help='detector name, across all versions of its program text')
+    parser_history.add_argument('--label', help='published label, either an exact label or a glob pattern')
+    parser_history.add_argument('--last', default=20, type=int, help='number of results to show')
+    parser_history.add_argument('--diff', action='store_true', default=False,
+                                help='compare the events of the two latest results of the latest detector, per '
+                                     'time series')
+    parser_history.set_defaults(func=command('signalform_tools.history', 'history_signalform'))
 
     parser_show = subparsers.add_parser(
         'show',
@@ -63,7 +155,47 @@ def parse_args():
         description="Show resources inside the \
             tfstate of the current directory.")
     parser_show.add_argument('-r', '--remote', action='store_true', default=False, help='Use remote state')
-    parser_show.set_defaults(func=show_signalform)
+    parser_show.set_defaults(func=command('signalform_tools.show', 'show_signalform'))
+
+    parser_fake_preflight = subparsers.add_parser(
+        'fake-preflight',
+        help='fake-preflight help',
+        description='Run a local stand-in for the SignalFlow preflight API. Point preflight to it by setting the '
+                    'SFX_ENDPOINT environment variable or the "endpoint" key of the configuration file.')
+    parser_fake_preflight.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser_fake_preflight.add_argument('--port', default=8089, type=int, help='Port to listen on')
+    parser_fake_preflight.add_argument(
+        '--replay',
+        nargs='+',
+        metavar='FILE',
+        help='Recorded preflight responses to reply with in turn, synthetic events are sent by default',
+    )
+    parser_fake_preflight.add_argument('--series', default=10, type=int,
+                                       help='Number of time series firing in synthetic responses')
+    parser_fake_preflight.add_argument('--events', default=2, type=int,
+                                       help='Number of events per time series in synthetic responses')
+    parser_fake_preflight.add_argument('--latency', default=0, type=float, help='Delay before replying, in ms')
+    parser_fake_preflight.add_argument('--jitter', default=0, type=float,
+                                       help='Maximum random delay added to the latency, in ms')
+    parser_fake_preflight.add_argument('--throughput', default=0, type=int,
+                                       help='Maximum bytes per second sent per response, unlimited by default')
+    parser_fake_preflight.add_argument('--error-rate', default=0, type=float,
+                                       help='Fraction of requests failing with the error status')
+    parser_fake_preflight.add_argument('--error-status', default=503, type=int, help='Status of failing requests')
+    parser_fake_preflight.add_argument('--seed', type=int, help='Seed for latency jitter and error injection')
+    parser_fake_preflight.add_argument('-q', '--quiet', action='store_true', default=False,
+                                       help='Do not log requests')
+    parser_fake_preflight.set_defaults(func=command('signalform_tools.fake_preflight', 'fake_preflight_signalform'))
+
+    parser_bench_preflight = subparsers.add_parser(
+        'bench-preflight',
+        help='bench-preflight help',
+        description='Load test the preflight client and report requests/sec and latency percentiles. Meant to be '
+                    'run against fake-preflight.')
+    parser_bench_preflight.add_argument('--requests', default=100, type=int, help='Number of requests to send')
+    parser_bench_preflight.add_argument('--concurrency', default=4, type=int, help='Number of concurrent requests')
+    parser_bench_preflight.add_argument('--program', help='File containing the program text to send', type=str)
+    parser_bench_preflight.set_defaults(func=command('signalform_tools.bench_preflight', 'bench_preflight_signalform'))
 
     return parser.parse_args()
 
@@ -1,18 +1,76 @@
 # -*- coding: utf-8 -*-
-import boto3
+import codecs
 from contextlib import contextmanager
+import json
 import os
+import re
+import socket
 import subprocess
+import tempfile
 
 DEFAULT_REGION = "us-east-1"
+STREAM_CHUNK_SIZE = 64 * 1024
+TFSTATE_TOKEN_RE = re.compile(
+    r'\s*(?:(?P<string>"(?:[^"\\]|\\.)*")|(?P<punct>[{}\[\]:,])|(?P<scalar>[^\s{}\[\]:,"]+))'
+)
+DEFAULT_SOCKET_PATH = os.getenv(
+    "SIGNALFORM_TOOLS_SOCKET",
+    os.path.join(os.getenv("XDG_RUNTIME_DIR", tempfile.gettempdir()), "signalform-tools-{0}.sock".format(os.getuid())),
+)
+SOCKET_TIMEOUT = 30  # seconds
+DEFAULT_HISTORY_PATH = os.getenv(
+    "SIGNALFORM_TOOLS_HISTORY",
+    os.path.join(
+        os.getenv("XDG_DATA_HOME", os.path.join(os.path.expanduser("~"), ".local", "share")),
+        "signalform-tools", "history.db",
+    ),
+)
 
 
 @contextmanager
 def download_tfstate():
     tfstate = "/".join((os.getcwd(), "terraform.tfstate"))
-    tfvars = "/".join((os.getcwd(), "terraform.tfvars"))
     if os.path.isfile(tfstate):
         raise ValueError("Error: {0} already exists".format(tfstate))
+    client, s3_path = get_tfstate_location()
+    # boto3 is slow to import, keep it off the path of commands that don't need it
+    import boto3.s3.transfer
+    transfer = boto3.s3.transfer.S3Transfer(client)
+    # Download s3://bucket/key to filename
+    try:
+        transfer.download_file(s3_path["bucket"], s3_path["key"], tfstate)
+        yield
+    except OSError:
+        print("Impossible downloading file")
+    else:
+        os.remove(tfstate)
+
+
+def stream_tfstate(chunk_size=STREAM_CHUNK_SIZE):
+    """Stream the remote state from S3 without writing it to disk
+    :returns: iterator over chunks of the state file
+    """
+    client, s3_path = get_tfstate_location()
+    body = client.get_object(Bucket=s3_path["bucket"], Key=s3_path["key"])["Body"]
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+
+def read_tfstate(filename, chunk_size=STREAM_CHUNK_SIZE):
+    """Read a local state the way remote ones are streamed
+    :returns: iterator over chunks of the state file
+    """
+    with open(filename, "rb") as state_file:
+        yield from iter(lambda: state_file.read(chunk_size), b"")
+
+
+def get_tfstate_location():
+    """Find out where the remote state lives from terraform.tfvars
+    :returns: (S3 client, {"bucket": ..., "key": ...})
+    """
+    tfvars = "/".join((os.getcwd(), "terraform.tfvars"))
     aws_key = os.getenv('AWS_ACCESS_KEY_ID', None)
     aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY', None)
     if aws_key is None or aws_secret_key is None:
@@ -31,21 +89,139 @@ def download_tfstate():
 
     if not s3_path:
         raise ValueError("Error: missing s3 path information {0}".format(tfvars))
+    import boto3
     client = boto3.client(
         's3',
         d.get("s3_bucket_region", DEFAULT_REGION),
         aws_access_key_id=aws_key,
         aws_secret_access_key=aws_secret_key,
     )
-    transfer = boto3.s3.transfer.S3Transfer(client)
-    # Download s3://bucket/key to filename
+    return client, s3_path
+
+
+def iter_tfstate_resources(chunks):
+    """Incrementally parse resources out of a terraform state as its chunks come in,
+    without waiting for the whole state
+    :param chunks: iterable of bytes
+    :returns: iterator over (resource key, resource) pairs, e.g. ("signalform_detector.foo", {"primary": ...})
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    json_decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf, pos, eof = "", 0, False
+    # [key, expecting a key] for each open object, None for each open array
+    stack = []
+    while True:
+        token = TFSTATE_TOKEN_RE.match(buf, pos)
+        resource = None
+        if token and token.group("punct") == "{" and in_tfstate_resources(stack):
+            try:
+                resource, end = json_decoder.raw_decode(buf, token.start("punct"))
+            except json.JSONDecodeError:
+                # the resource is not fully downloaded yet
+                token = None
+        elif token and token.group("scalar") and token.end() == len(buf):
+            # the scalar may go on in the next chunk
+            token = None
+
+        if token is None:
+            if eof:
+                if stack or buf[pos:].strip():
+                    raise ValueError("Error: truncated or malformed terraform state")
+                return
+            chunk = next(chunks, None)
+            eof = chunk is None
+            buf, pos = buf[pos:] + decoder.decode(chunk or b"", final=eof), 0
+            continue
+
+        if resource is not None:
+            yield stack[-1][0], resource
+            pos = end
+            continue
+
+        pos = token.end()
+        punct = token.group("punct")
+        if punct == "{":
+            stack.append([None, True])
+        elif punct == "[":
+            stack.append(None)
+        elif punct in ("}", "]"):
+            stack.pop()
+        elif punct in (",", ":") and stack and stack[-1] is not None:
+            stack[-1][1] = punct == ","
+        elif token.group("string") and stack and stack[-1] is not None and stack[-1][1]:
+            stack[-1][0] = json.loads(token.group("string"))
+
+
+def in_tfstate_resources(stack):
+    """Tell whether the parser stands on a value of {"modules": [{"resources": {...}}]}"""
+    return (
+        len(stack) == 4
+        and stack[0] is not None and stack[0][0] == "modules"
+        and stack[1] is None
+        and stack[2] is not None and stack[2][0] == "resources"
+        and stack[3] is not None and not stack[3][1]
+    )
+
+
+def iter_state_resources(state):
+    """Walk the resources of a terraform state or of `terraform show -json` output (state or plan)
+    :returns: iterator of (resource type, resource name, attributes)
+    :raise: ValueError
+    """
     try:
-        transfer.download_file(s3_path["bucket"], s3_path["key"], tfstate)
-        yield
-    except OSError:
-        print("Impossible downloading file")
+        yield from walk_state_resources(state)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError("Error: unrecognized terraform state or plan format") from e
+
+
+def walk_state_resources(state):
+    if "modules" in state:  # state format version 3, attributes are flattened
+        for module in state["modules"]:
+            for key, resource in module["resources"].items():
+                if not key.startswith("data."):
+                    yield resource["type"], key.split(".", 1)[1], expand_flatmap(resource["primary"]["attributes"])
+    elif "resources" in state:  # state format version 4
+        for resource in state["resources"]:
+            if resource.get("mode", "managed") == "managed":
+                for instance in resource["instances"]:
+                    yield resource["type"], resource["name"], instance["attributes"]
+    elif "values" in state or "planned_values" in state:
+        values = state.get("values") or state.get("planned_values") or {}
+        modules = [values.get("root_module", {})]
+        while modules:
+            module = modules.pop()
+            modules.extend(module.get("child_modules", []))
+            for resource in module.get("resources", []):
+                if resource.get("mode", "managed") == "managed":
+                    yield resource["type"], resource["name"], resource.get("values") or {}
     else:
-        os.remove(tfstate)
+        raise ValueError("Error: unrecognized terraform state or plan format")
+
+
+def expand_flatmap(attributes):
+    """Expand terraform 0.11 flattened attributes, e.g. {"rule.#": "1", "rule.123.severity": "Major"}, into
+    nested lists and maps, e.g. {"rule": [{"severity": "Major"}]}
+    """
+    nested = {}
+    for key, value in attributes.items():
+        node = nested
+        *parents, leaf = key.split(".")
+        for parent in parents:
+            node = node.setdefault(parent, {})
+            if not isinstance(node, dict):
+                break
+        else:
+            node[leaf] = value
+
+    def unflatten(node):
+        if not isinstance(node, dict):
+            return node
+        if "#" in node:
+            return [unflatten(value) for key, value in node.items() if key != "#"]
+        return {key: unflatten(value) for key, value in node.items() if key != "%"}
+
+    return unflatten(nested)
 
 
 def extract_s3_path(d):
@@ -59,3 +235,39 @@ def extract_s3_path(d):
     output = output.decode("utf-8").strip()
     relative_dir = os.getcwd().replace(output, "")
     return {"bucket": "".join(("tf-rs-", d["account"])), "key": "/".join((relative_dir[1:], "terraform.tfstate"))}
+
+
+def list_changed_files(since, directory):
+    """List files inside directory changed since the given git ref, renamed and untracked (but not ignored) files
+    included. Deleted files are left out, paths are returned relative to directory.
+    """
+    changed = run_git_list(
+        ["git", "-C", directory, "diff", "--name-only", "--relative", "-M", "--diff-filter=ACMRT", "-z", since, "--"],
+        since,
+    )
+    untracked = run_git_list(["git", "-C", directory, "ls-files", "--others", "--exclude-standard", "-z"], since)
+    return list(dict.fromkeys(changed + untracked))
+
+
+def run_git_list(command, since):
+    """Run a git command listing NUL separated paths"""
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = process.communicate()
+    if process.returncode != 0:
+        raise ValueError("Error: can't list files changed since {0}: {1}".format(since, error.decode("utf-8").strip()))
+    return [path for path in output.decode("utf-8").split("\0") if path]
+
+
+def send_socket_request(path, request, timeout=SOCKET_TIMEOUT):
+    """Send a JSON request to a local signalform-tools server
+    :returns: the JSON response, None if no server is listening on path or if it didn't answer properly
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(path)
+            client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with client.makefile("rb") as response:
+                return json.loads(response.readline())
+    except (OSError, ValueError):
+        return None
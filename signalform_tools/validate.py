@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
+import io
+import json
 import os
 import re
-from enum import auto
-from enum import Enum
-from functools import reduce
+import sys
+import time
+from collections import defaultdict
+from collections import OrderedDict
+from functools import lru_cache
+from importlib.metadata import entry_points
+from importlib.metadata import EntryPoint
 from itertools import chain
+from threading import Lock
 from typing import Any
 from typing import Callable
+from typing import Container
 from typing import Dict
+from typing import Hashable
 from typing import IO
 from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
 from typing import Set
@@ -17,6 +27,10 @@ from typing import Tuple
 from typing import Type
 from typing import TypeVar
 
+from signalform_tools.utils import iter_state_resources
+from signalform_tools.utils import list_changed_files
+from signalform_tools.utils import send_socket_request
+
 
 flatten = chain.from_iterable
 
@@ -28,20 +42,132 @@ ParsingRule = Callable[[str], Optional[Property]]
 ValidationRule = Callable[[T], Optional[str]]
 
 
+class RuleStats:
+    """Call counts and cumulative time spent in each parsing and validation rule"""
+
+    def __init__(self) -> None:
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.lock = Lock()
+
+    def call(self, rule: Callable[[Any], Any], arg: Any) -> Any:
+        begin = time.perf_counter()
+        try:
+            return rule(arg)
+        finally:
+            elapsed = time.perf_counter() - begin
+            name = f"{rule.__module__}.{rule.__qualname__}"
+            with self.lock:
+                self.calls[name] += 1
+                self.seconds[name] += elapsed
+
+    def report(self) -> str:
+        width = max([len(name) for name in self.calls] + [len("Rule")])
+        lines = [f"{'Rule':<{width}} {'Calls':>9} {'Total ms':>10} {'Avg us':>9}"]
+        for name in sorted(self.calls, key=self.seconds.get, reverse=True):
+            calls, seconds = self.calls[name], self.seconds[name]
+            lines.append(f"{name:<{width}} {calls:>9} {seconds * 1e3:>10.2f} {seconds / calls * 1e6:>9.1f}")
+        return "\n".join(lines)
+
+
+# set by enable_rule_stats to start recording rule costs
+rule_stats: Optional[RuleStats] = None
+
+
+def enable_rule_stats() -> RuleStats:
+    global rule_stats
+    rule_stats = RuleStats()
+    return rule_stats
+
+
+def apply_rules(rules: Iterable[Callable[[Any], Any]], arg: Any) -> List[Any]:
+    """Call each rule on the argument, recording their cost when rule stats are enabled"""
+    stats = rule_stats
+    if stats is None:
+        return [rule(arg) for rule in rules]
+    return [stats.call(rule, arg) for rule in rules]
+
+
 def parse(line: str, rules: Iterable[ParsingRule]):
     """Parse properties out from a line based on some parsing rules"""
-    properties = [rule(line) for rule in rules]
+    properties = apply_rules(rules, line)
     return [prop for prop in properties if prop]
 
 
+class ValidationCache:
+    """Bounded LRU cache of validation outcomes, shared by all the resources validated in the process"""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[List[str]]:
+        with self.lock:
+            violations = self.entries.get(key)
+            if violations is not None:
+                self.entries.move_to_end(key)
+            return violations
+
+    def put(self, key: Hashable, violations: List[str]) -> None:
+        with self.lock:
+            self.entries[key] = violations
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+VALIDATION_CACHE_SIZE = 4096
+validation_cache = ValidationCache(VALIDATION_CACHE_SIZE)
+
+
+def freeze(value: Any) -> Hashable:
+    """Turn a resource field into something hashable"""
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    return value
+
+
+def fingerprint(resource: T) -> Hashable:
+    """Fingerprint the content of a resource, leaving its name out"""
+    return type(resource), tuple(sorted((k, freeze(v)) for k, v in vars(resource).items() if k != "name"))
+
+
+def find_violations(resource: T, rules: Iterable[ValidationRule]) -> List[str]:
+    """Run validation rules against a terraform resource.
+    Outcomes of memoizable rules are shared by resources with the same content, e.g. generated charts, except
+    when rule stats are enabled, so that they measure the cost of every rule on every resource.
+    :return: violation messages
+    """
+    rules = list(rules)
+    if rule_stats is not None:
+        return [v for v in apply_rules(rules, resource) if v]
+    memoized = frozenset(rule for rule in rules if getattr(rule, "memoize", False))
+    key = (memoized, fingerprint(resource))
+    violations = validation_cache.get(key)
+    if violations is None:
+        violations = [v for v in apply_rules(memoized, resource) if v]
+        validation_cache.put(key, violations)
+    others = [rule for rule in rules if not getattr(rule, "memoize", False)]
+    return violations + [v for v in apply_rules(others, resource) if v]
+
+
+def format_warning(res_type: str, name: str, violations: List[str]) -> str:
+    """Format violations of a resource into a warning message"""
+    return "\n\t".join((f"{res_type} - {name}:", *violations))
+
+
 def validate(resource: T, rules: Iterable[ValidationRule]) -> Optional[str]:
     """Validate terraform resource and warn in case of violations
     :return: warning message to show
     """
-    violations = [rule(resource) for rule in rules]
-    violations = [v for v in violations if v]
+    violations = find_violations(resource, rules)
     if violations:
-        return "\n\t".join((f"{resource.type} - {resource.name}:", *violations))
+        return format_warning(resource.type, resource.name, violations)
     return None
 
 
@@ -57,6 +183,10 @@ class Resource:
     def from_config(self, config: List[str]) -> 'Resource':
         raise NotImplementedError("Resource cannot be instantiated directly from config")
 
+    @classmethod
+    def from_attributes(cls, name: str, attributes: Dict[str, Any]) -> 'Resource':
+        raise NotImplementedError("Resource cannot be instantiated directly from attributes")
+
     @classmethod
     def register_parsing_rule(cls, rule: ParsingRule) -> None:
         cls.parsing_rules = cls.parsing_rules | {rule}
@@ -97,6 +227,10 @@ class SignalFlowResource(Resource):
     def from_config(self, config: List[str]) -> 'SignalFlowResource':
         raise NotImplementedError("SignalFlowResource cannot be instantiated directly from config")
 
+    @classmethod
+    def from_attributes(cls, name: str, attributes: Dict[str, Any]) -> 'SignalFlowResource':
+        raise NotImplementedError("SignalFlowResource cannot be instantiated directly from attributes")
+
     @classmethod
     def get_parsing_rules(cls) -> Set[ParsingRule]:
         return SignalFlowResource.parsing_rules | super().get_parsing_rules()
@@ -145,6 +279,20 @@ class Detector(SignalFlowResource):
         except KeyError as e:
             raise ValueError(f"Required field '{e.args[0]}' missing for detector") from e
 
+    @classmethod
+    def from_attributes(cls, name: str, attributes: Dict[str, Any]) -> 'Detector':
+        rules = attributes.get("rule") or []
+        try:
+            return Detector(
+                name,
+                attributes["program_text"],
+                parse_optional_int(attributes.get("max_delay")),
+                {rule["detect_label"] for rule in rules if rule.get("detect_label")},
+                [rule["runbook_url"] for rule in rules if rule.get("runbook_url")],
+            )
+        except KeyError as e:
+            raise ValueError(f"Required field '{e.args[0]}' missing for detector") from e
+
     @classmethod
     def get_parsing_rules(cls) -> Set[ParsingRule]:
         return Detector.parsing_rules | super().get_parsing_rules()
@@ -175,6 +323,13 @@ class Chart(SignalFlowResource):
         except KeyError as e:
             raise ValueError(f"Required field '{e.args[0]}' missing for chart") from e
 
+    @classmethod
+    def from_attributes(cls, name: str, attributes: Dict[str, Any]) -> 'Chart':
+        try:
+            return Chart(name, attributes["program_text"], parse_optional_int(attributes.get("max_delay")))
+        except KeyError as e:
+            raise ValueError(f"Required field '{e.args[0]}' missing for chart") from e
+
     @classmethod
     def get_parsing_rules(cls) -> Set[ParsingRule]:
         return Chart.parsing_rules | super().get_parsing_rules()
@@ -205,6 +360,10 @@ class TextNote(Resource):
         except KeyError as e:
             raise ValueError(f"Required field '{e.args[0]}' missing for text note") from e
 
+    @classmethod
+    def from_attributes(cls, name: str, attributes: Dict[str, Any]) -> 'TextNote':
+        return TextNote(name)
+
     @classmethod
     def get_parsing_rules(cls) -> Set[ParsingRule]:
         return TextNote.parsing_rules | super().get_parsing_rules()
@@ -235,6 +394,10 @@ class Dashboard(Resource):
         except KeyError as e:
             raise ValueError(f"Required field '{e.args[0]}' missing for dashboard") from e
 
+    @classmethod
+    def from_attributes(cls, name: str, attributes: Dict[str, Any]) -> 'Dashboard':
+        return Dashboard(name)
+
     @classmethod
     def get_parsing_rules(cls) -> Set[ParsingRule]:
         return Dashboard.parsing_rules | super().get_parsing_rules()
@@ -265,6 +428,10 @@ class DashboardGroup(Resource):
         except KeyError as e:
             raise ValueError(f"Required field '{e.args[0]}' missing for dashboard group") from e
 
+    @classmethod
+    def from_attributes(cls, name: str, attributes: Dict[str, Any]) -> 'DashboardGroup':
+        return DashboardGroup(name)
+
     @classmethod
     def get_parsing_rules(cls) -> Set[ParsingRule]:
         return DashboardGroup.parsing_rules | super().get_parsing_rules()
@@ -311,9 +478,16 @@ def register_parsing_rule(*resources: Type[Resource]) -> Callable[[ParsingRule],
     return decorator
 
 
-def register_validation_rule(*resources: Type[Resource]) -> Callable[[ValidationRule], ValidationRule]:
-    """Decorator to associate validation rules to resources"""
+def register_validation_rule(
+    *resources: Type[Resource],
+    memoize: bool = False,
+) -> Callable[[ValidationRule], ValidationRule]:
+    """Decorator to associate validation rules to resources
+    :param memoize: share the rule outcome between resources with the same content, only for rules that do not
+    depend on the resource name
+    """
     def decorator(rule: ValidationRule) -> ValidationRule:
+        rule.memoize = memoize
         for resource in resources:
             resource.register_validation_rule(rule)
         return rule
@@ -321,8 +495,56 @@ def register_validation_rule(*resources: Type[Resource]) -> Callable[[Validation
     return decorator
 
 
+# Rule plugins
+#
+# Packages can ship their own rules by declaring, for each terraform resource type they target, an entry point
+# in the signalform_tools.rules group pointing to a module registering rules with the decorators above, e.g.
+#     entry_points={'signalform_tools.rules': ['signalform_detector = my_rules.detectors']}
+# Plugin modules are only imported once a resource of that type shows up in the validated configurations.
+
+RULE_PLUGINS_GROUP = 'signalform_tools.rules'
+
+loaded_plugin_types: Set[str] = set()
+plugins_lock = Lock()
+
+
+@lru_cache(maxsize=None)
+def rule_plugins() -> Dict[str, List[EntryPoint]]:
+    """Rule plugin entry points by the resource type they target"""
+    eps = entry_points()
+    group = eps.select(group=RULE_PLUGINS_GROUP) if hasattr(eps, 'select') else eps.get(RULE_PLUGINS_GROUP, [])
+    plugins: Dict[str, List[EntryPoint]] = defaultdict(list)
+    for ep in group:
+        plugins[ep.name].append(ep)
+    return plugins
+
+
+def load_rule_plugins(res_type: str) -> None:
+    """Import the rule plugins targeting a resource type, once
+    :raise: ValueError
+    """
+    if res_type in loaded_plugin_types:
+        return
+    with plugins_lock:
+        if res_type in loaded_plugin_types:
+            return
+        for ep in rule_plugins().get(res_type, []):
+            try:
+                ep.load()
+            except Exception as e:
+                raise ValueError(f"Can't load rule plugin '{ep.name} = {ep.value}': {e}") from e
+        loaded_plugin_types.add(res_type)
+
+
 # Parsing and validation rules
 
+def parse_optional_int(value: Any) -> Optional[int]:
+    """Parse an integer attribute, which terraform 0.11 states store as a string"""
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
 def get_kv_config(line: str) -> Tuple[str, str]:
     """Tokenize key value from config
     :return: extracted key value pair
@@ -348,7 +570,7 @@ def parse_program_text(line: str) -> Optional[Property]:
     return None
 
 
-@register_validation_rule(SignalFlowResource)
+@register_validation_rule(SignalFlowResource, memoize=True)
 def validate_parentheses(resource: SignalFlowResource) -> Optional[str]:
     """Warn if parentheses in program_text aren't balanced
     :return: warning message
@@ -374,7 +596,7 @@ def parse_max_delay(line: str) -> Optional[Property]:
     return None
 
 
-@register_validation_rule(Detector)
+@register_validation_rule(Detector, memoize=True)
 def validate_max_delay(resource: Detector) -> Optional[str]:
     """Warn if value of max_delay may be too small
     :return: warning message
@@ -400,7 +622,7 @@ def parse_runbook_url(line: str) -> Optional[Property]:
     return None
 
 
-@register_validation_rule(Detector)
+@register_validation_rule(Detector, memoize=True)
 def validate_detect_labels(resource: Detector) -> Optional[str]:
     """Warn if detect labels are not in the program text
     :return: warning message
@@ -411,7 +633,7 @@ def validate_detect_labels(resource: Detector) -> Optional[str]:
     return None
 
 
-@register_validation_rule(Detector)
+@register_validation_rule(Detector, memoize=True)
 def validate_runbook_url(resource: Detector) -> Optional[str]:
     """Warn if runbook_url is not present within detector rules.
     :return warning message
@@ -428,55 +650,24 @@ def validate_runbook_url(resource: Detector) -> Optional[str]:
 HEREDOC_RE = re.compile(r"(.*)<<-?(\S+)\s*$")
 
 
-class Heredoc(Enum):
-    START = auto()
-    MIDDLE = auto()
-    END = auto()
-    NO = auto()
-
-
-def compact_heredoc(lines: List[str]) -> List[str]:
-    start_eof = [
-        (i, HEREDOC_RE.match(line).group(2))
-        for i, line in enumerate(lines)
-        if HEREDOC_RE.match(line)
-    ]
-
-    def find_end(eof: str, start: int) -> int:
-        EOF_REGEX = re.compile(fr"^\s*{eof}\s*$")
-        for i, line in enumerate(lines[start + 1:]):
-            if EOF_REGEX.match(line):
-                return i + start + 1
-        raise ValueError(f"Here-doc inputs are not properly delimited. Can't find end delimiter for: {eof}")
-
-    start_end = [(start, find_end(eof, start)) for start, eof in start_eof]
-
-    def heredoc_where(index: int) -> Heredoc:
-        for start, end in start_end:
-            if start < index < end:
-                return Heredoc.MIDDLE
-            if index == start:
-                return Heredoc.START
-            if index == end:
-                return Heredoc.END
-        return Heredoc.NO
-
-    heredoc_state = [heredoc_where(i) for i in range(len(lines))]
-
-    def compact(compacted: List[str], indexed_line: Tuple[int, str]) -> List[str]:
-        index, line = indexed_line
-        state = heredoc_state[index]
-        if state == Heredoc.NO:
-            return compacted + [line]
-        if state == Heredoc.START:
-            return compacted + [HEREDOC_RE.match(line).group(1)]
-        if state == Heredoc.MIDDLE:
-            return compacted[:-1] + [compacted[-1] + "\n" + line]
-        if state == Heredoc.END:
-            return compacted
-        raise ValueError("Here-doc inputs are not properly delimited")
-
-    return reduce(compact, enumerate(lines), [])
+def compact_heredoc(lines: Iterable[str]) -> Iterator[str]:
+    """Fold here-doc bodies into the line opening them, one line at a time"""
+    lines = iter(lines)
+    for line in lines:
+        match = HEREDOC_RE.match(line)
+        if not match:
+            yield line
+            continue
+        head, eof = match.groups()
+        eof_re = re.compile(fr"^\s*{eof}\s*$")
+        body = [head]
+        for line in lines:
+            if eof_re.match(line):
+                break
+            body.append(line)
+        else:
+            raise ValueError(f"Here-doc inputs are not properly delimited. Can't find end delimiter for: {eof}")
+        yield "\n".join(body)
 
 
 def strip_comments(line: str) -> str:
@@ -494,46 +685,105 @@ def strip_comments(line: str) -> str:
     return line
 
 
-def clean_conf(tf_conf: IO[Any]) -> List[str]:
+def clean_conf(tf_conf: IO[Any]) -> Iterator[str]:
     """Clean Terraform configurations from syntax-specific artifacts"""
-    lines = [strip_comments(line.strip()) for line in tf_conf]
-    lines = [line for line in lines if line]
-    lines = compact_heredoc(lines)
-    return lines
+    lines = (strip_comments(line.strip()) for line in tf_conf)
+    lines = (line for line in lines if line)
+    return compact_heredoc(lines)
 
 
 # Main logic
 
-def parse_resources(tf_conf: IO[Any], available_resources: Dict[str, Type[Resource]]) -> List[Resource]:
-    """Parse resources out from the configuration"""
-    lines = clean_conf(tf_conf)
-    types = [parse_type(line) for line in lines]
-    starts = [i for i, t in enumerate(types) if t]
-    stanzas = [lines[i:j] for i, j in zip(starts, starts[1:] + [None])]
-    types = [t for t in types if t]
-    resources = [
-        available_resources[t].from_config(stanza)
-        for t, stanza in zip(types, stanzas)
-        if t in available_resources
-    ]
-    return resources
+def split_stanzas(lines: Iterable[str], types: Container[str]) -> Iterator[Tuple[str, List[str]]]:
+    """Group lines by the resource they belong to, keeping only resources of the given types
+    :return: (resource type, resource stanza) pairs
+    """
+    res_type, stanza = None, None
+    for line in lines:
+        line_type = parse_type(line)
+        if line_type:
+            if stanza is not None:
+                yield res_type, stanza
+            res_type, stanza = line_type, [] if line_type in types else None
+        if stanza is not None:
+            stanza.append(line)
+    if stanza is not None:
+        yield res_type, stanza
+
+
+def parse_resources(tf_conf: IO[Any], available_resources: Dict[str, Type[Resource]]) -> Iterator[Resource]:
+    """Lazily parse resources out from the configuration"""
+    for res_type, stanza in split_stanzas(clean_conf(tf_conf), available_resources):
+        load_rule_plugins(res_type)
+        yield available_resources[res_type].from_config(stanza)
+
+
+def parse_state_resources(state: Dict[str, Any], available_resources: Dict[str, Type[Resource]]) -> Iterator[Resource]:
+    """Lazily build resources out of the attributes of a terraform state or plan, skipping HCL parsing"""
+    for res_type, name, attributes in iter_state_resources(state):
+        if res_type in available_resources:
+            load_rule_plugins(res_type)
+            try:
+                resource = available_resources[res_type].from_attributes(name, attributes)
+            except (TypeError, AttributeError) as e:
+                raise ValueError(f"Error: unexpected attributes for {res_type}.{name}") from e
+            yield resource
+
+
+def collect_warnings(filename: str, resources: Iterable[Resource], warnings: List[Dict[str, Any]]) -> None:
+    """Validate resources, appending structured warnings as they get validated"""
+    for resource in resources:
+        violations = find_violations(resource, resource.get_validation_rules())
+        if violations:
+            warnings.append({"filename": filename, "type": resource.type, "name": resource.name,
+                             "violations": violations})
+
+
+def validate_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate files and editor buffers, in process or on behalf of a client of the validation server
+    :param request: {"paths": [path, ...], "buffers": [{"filename": name, "content": text}, ...],
+                     "states": [path to a terraform state or `terraform show -json` output, ...]}
+    :return: {"warnings": [{"filename", "type", "name", "violations"}, ...], "errors": [{"filename", "error"}, ...]}
+    """
+    warnings: List[Dict[str, Any]] = []
+    errors: List[Dict[str, str]] = []
+    for path in request.get("paths", []):
+        try:
+            with open(path) as tf_conf:
+                collect_warnings(path, parse_resources(tf_conf, AVAILABLE_RESOURCES), warnings)
+        except (OSError, ValueError) as err:
+            errors.append({"filename": path, "error": str(err)})
+    for buffer in request.get("buffers", []):
+        try:
+            collect_warnings(
+                buffer["filename"], parse_resources(io.StringIO(buffer["content"]), AVAILABLE_RESOURCES), warnings,
+            )
+        except ValueError as err:
+            errors.append({"filename": buffer["filename"], "error": str(err)})
+    for path in request.get("states", []):
+        try:
+            with open(path) as state_file:
+                state = json.load(state_file)
+            collect_warnings(path, parse_state_resources(state, AVAILABLE_RESOURCES), warnings)
+        except (OSError, ValueError) as err:
+            errors.append({"filename": path, "error": str(err)})
+    return {"warnings": warnings, "errors": errors}
 
 
-def validate_config(tf_conf: IO[Any], available_resources: Dict[str, Type[Resource]]) -> int:
-    """Parse and validate resource starting from a terraform configuration
-    :side effect: print warnings
-    """
-    resources = parse_resources(tf_conf, available_resources)
-    warnings = [resource.validate() for resource in resources]
-    warnings = [w for w in warnings if w]
-    for warning in warnings:
-        print(warning)
-    return len(warnings)
+def build_request(filenames: Iterable[str], states: Iterable[str] = ()) -> Dict[str, Any]:
+    """Build a validation request, reading the configuration from stdin for the '-' filename"""
+    request: Dict[str, Any] = {"paths": [], "buffers": [], "states": [os.path.abspath(state) for state in states]}
+    for filename in filenames:
+        if filename == '-':
+            request["buffers"].append({"filename": "<stdin>", "content": sys.stdin.read()})
+        else:
+            request["paths"].append(os.path.abspath(filename))
+    return request
 
 
-def validate_file(filename: str, available_resources: Dict[str, Type[Resource]]) -> int:
-    with open(filename) as tf_conf:
-        return validate_config(tf_conf, available_resources)
+def is_validated_file(filename: str) -> bool:
+    """Tell whether a terraform file in a directory should be validated"""
+    return filename.endswith('.tf') and filename != 'shared.tf'
 
 
 def list_filenames(directory: str) -> List[str]:
@@ -541,11 +791,44 @@ def list_filenames(directory: str) -> List[str]:
     return [
         os.path.join(directory, filename)
         for filename in os.listdir(directory)
-        if filename.endswith('.tf') and filename != 'shared.tf'
+        if is_validated_file(filename)
+    ]
+
+
+def list_changed_filenames(directory: str, since: str) -> List[str]:
+    """List terraform files in a directory changed since a git ref"""
+    return [
+        os.path.join(directory, filename)
+        for filename in list_changed_files(since, directory)
+        if os.path.dirname(filename) == '' and is_validated_file(filename)
     ]
 
 
 def validate_signalform(args):
-    filenames = args.filenames if args.filenames else list_filenames(args.dir)
-    retvalue = sum(validate_file(filename, AVAILABLE_RESOURCES) for filename in filenames)
-    exit(retvalue)
+    if args.since and (args.filenames or args.state):
+        print("ERROR: --since selects the files to validate, it can't be combined with filenames or --state")
+        exit(1)
+    if args.filenames or args.state:
+        filenames = args.filenames
+    elif args.since:
+        try:
+            filenames = list_changed_filenames(args.dir, args.since)
+        except ValueError as err:
+            print(err.args[0])
+            exit(1)
+    else:
+        filenames = list_filenames(args.dir)
+    request = build_request(filenames, args.state or [])
+    # rule costs are only measured in process
+    in_process = args.no_server or args.rule_stats
+    response = None if in_process else send_socket_request(args.socket, request)
+    if response is None:
+        stats = enable_rule_stats() if args.rule_stats else None
+        response = validate_request(request)
+    for warning in response["warnings"]:
+        print(format_warning(warning["type"], warning["name"], warning["violations"]))
+    for error in response["errors"]:
+        print(f"ERROR: {error['filename']}: {error['error']}")
+    if args.rule_stats:
+        print(stats.report())
+    exit(len(response["warnings"]) + len(response["errors"]))
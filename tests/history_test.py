@@ -0,0 +1,106 @@
+import pytest
+
+from signalform_tools.history import History
+from signalform_tools.history import latest_pair
+from signalform_tools.preflight import DetectorProgram
+from signalform_tools.preflight import Event
+from signalform_tools.preflight import iter_events
+from signalform_tools.preflight import render_events
+
+
+PROGRAM_TEXT = "detect(when(data('cpu') > 90)).publish('cpu-high')"
+EVENTS = [Event("a", 1000, "anomalous"), Event("a", 5000, "ok"), Event("b", 8000, "anomalous")]
+
+
+class Backend:
+    """Preflight backend answering EVENTS within the requested window, counting requests"""
+
+    def __init__(self):
+        self.requests = 0
+
+    def __call__(self, program_text, start, stop):
+        self.requests += 1
+        return 200, render_events([event for event in EVENTS if start <= event.timestamp <= stop], start, stop)
+
+
+@pytest.fixture
+def history(tmp_path):
+    with History(str(tmp_path / "history.db")) as history:
+        history.start_run("test", 0, 10000)
+        yield history
+
+
+def test_record_and_lookup(history):
+    history.record(PROGRAM_TEXT, 0, 10000, 200, EVENTS)
+    result_id = history.lookup(PROGRAM_TEXT, 2000, 9000)
+    assert result_id is not None
+    assert history.result_events(result_id, 2000, 9000) == EVENTS[1:]
+    assert history.lookup(PROGRAM_TEXT, 0, 20000) is None
+    assert history.lookup("detect(when(data('cpu') > 80)).publish('cpu-high')", 0, 10000) is None
+
+
+def test_lookup_ignores_errors_and_other_sources(history):
+    history.record(PROGRAM_TEXT, 0, 10000, 400, [])
+    assert history.lookup(PROGRAM_TEXT, 0, 10000) is None
+    history.record(PROGRAM_TEXT, 0, 10000, 200, EVENTS)
+    history.start_run("other", 0, 10000)
+    assert history.lookup(PROGRAM_TEXT, 0, 10000) is None
+
+
+def test_sender_does_not_reuse_by_default(history):
+    backend = Backend()
+    send = history.sender(backend)
+    send(PROGRAM_TEXT, 0, 10000)
+    send(PROGRAM_TEXT, 2000, 9000)
+    assert backend.requests == 2
+    assert history.reused == 0
+
+
+def test_sender_reuse(history):
+    backend = Backend()
+    send = history.sender(backend, reuse=True)
+    send(PROGRAM_TEXT, 0, 10000)
+    status_code, text = send(PROGRAM_TEXT, 2000, 9000)
+    assert backend.requests == 1
+    assert history.reused == 1
+    assert status_code == 200
+    assert list(iter_events(text)) == EVENTS[1:]
+    # reused results refer to the original one, whose events are answered again
+    send(PROGRAM_TEXT, 2000, 9000)
+    assert history.reused == 2
+    assert backend.requests == 1
+
+
+def test_trend(history):
+    backend = Backend()
+    send = history.sender(backend, reuse=True)
+    detectors = list(history.observe([DetectorProgram("cpu", PROGRAM_TEXT)]))
+    assert len(detectors) == 1
+    send(PROGRAM_TEXT, 0, 10000)
+    send(PROGRAM_TEXT, 2000, 9000)
+
+    rows = history.trend("cpu", None, 10)
+    assert [(start, stop, triggered, resolved, cached, names) for _, _, start, stop, _, triggered, resolved, cached,
+            names in rows] == [(0, 10000, 2, 1, 0, "cpu"), (2000, 9000, 1, 1, 1, "cpu")]
+    assert len(history.trend(None, "cpu-*", 10)) == 2
+    assert history.trend(None, "mem-*", 10) == []
+    assert len(history.trend(None, None, 1)) == 1
+
+
+def test_latest_pair_of_the_same_detector(history):
+    other_text = "detect(when(data('mem') > 90)).publish('mem-high')"
+    send = history.sender(Backend())
+    list(history.observe([DetectorProgram("cpu", PROGRAM_TEXT), DetectorProgram("mem", other_text)]))
+    send(PROGRAM_TEXT, 0, 10000)
+    send(other_text, 0, 10000)
+    # a single run of two detectors has nothing to diff
+    assert latest_pair(history.trend(None, None, 10)) is None
+
+    history.start_run("test", 0, 10000)
+    new_text = "detect(when(data('cpu') > 80)).publish('cpu-high')"
+    list(history.observe([DetectorProgram("cpu", new_text)]))
+    send(new_text, 0, 10000)
+    rows = history.trend(None, None, 10)
+    old, new = latest_pair(rows)
+    assert (old, new) == (rows[0], rows[2])
+    assert old[-1] == new[-1] == "cpu"
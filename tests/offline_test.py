@@ -0,0 +1,134 @@
+import pytest
+
+from signalform_tools.preflight import iter_events
+
+np = pytest.importorskip("numpy")
+from signalform_tools.offline import OfflinePreflight  # noqa: E402
+
+
+START = 1577836800
+
+
+def write_csv(tmp_path, rows):
+    path = tmp_path / "metrics.csv"
+    lines = ["timestamp,metric,value,host,env"]
+    lines += [",".join(str(cell) for cell in row) for row in rows]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def every_minute(host, values, env="prod", offset=0):
+    return [(START + 60 * minute + offset, "cpu", value, host, env) for minute, value in enumerate(values)]
+
+
+def preflight(tmp_path, rows, program_text, resolution=None):
+    send = OfflinePreflight(write_csv(tmp_path, rows), resolution)
+    status_code, text = send(program_text, START * 1000, (START + 3600) * 1000)
+    return status_code, list(iter_events(text)) if status_code == 200 else text
+
+
+def states(events):
+    return [(event.state, (event.timestamp // 1000 - START) // 60) for event in events]
+
+
+def test_threshold(tmp_path):
+    status_code, events = preflight(
+        tmp_path, every_minute("a", [50, 95, 95, 50, 95]), "detect(when(data('cpu') > 90)).publish('cpu')",
+    )
+    assert status_code == 200
+    assert states(events) == [("anomalous", 1), ("ok", 3), ("anomalous", 4)]
+
+
+@pytest.mark.parametrize("lasting, expected", [
+    ("3m", [("anomalous", 3), ("ok", 4)]),
+    ("150s", [("anomalous", 3), ("ok", 4)]),
+    ("4m", []),
+    ("1ms", [("anomalous", 1), ("ok", 4)]),
+])
+def test_lasting(tmp_path, lasting, expected):
+    status_code, events = preflight(
+        tmp_path, every_minute("a", [50, 95, 95, 95, 50, 50]),
+        f"detect(when(data('cpu') > 90, lasting='{lasting}')).publish('cpu')",
+    )
+    assert status_code == 200
+    assert states(events) == expected
+
+
+def test_lasting_unaligned_series(tmp_path):
+    rows = every_minute("a", [50, 95, 95, 50, 50]) + every_minute("b", [50] * 5, offset=1)
+    status_code, events = preflight(
+        tmp_path, rows, "detect(when(data('cpu').mean(by=['host']) > 90, lasting='2m')).publish('cpu')",
+    )
+    assert status_code == 200
+    assert states(events) == [("anomalous", 2), ("ok", 3)]
+
+
+def test_lasting_over_gap(tmp_path):
+    status_code, events = preflight(
+        tmp_path, every_minute("a", [50, 95, 95, "", 95, 50]),
+        "detect(when(data('cpu') > 90, lasting='4m')).publish('cpu')",
+    )
+    assert status_code == 200
+    assert states(events) == [("anomalous", 4), ("ok", 5)]
+
+
+def test_resolution_rollup(tmp_path):
+    # a point every 30s, rolled up into 1m averages
+    rows = [(START + 30 * i, "cpu", value, "a", "prod") for i, value in enumerate([50, 50, 80, 100, 100, 100])]
+    status_code, events = preflight(
+        tmp_path, rows, "detect(when(data('cpu') > 85)).publish('cpu')", resolution=60000,
+    )
+    assert status_code == 200
+    assert states(events) == [("anomalous", 1)]
+
+
+def test_filters(tmp_path):
+    rows = every_minute("a", [95, 50]) + every_minute("b", [95, 50], env="dev") + every_minute("c", [50, 95])
+    status_code, events = preflight(
+        tmp_path, rows,
+        "detect(when(data('cpu', filter=filter('env', 'prod') and not filter('host', 'c*')) > 90)).publish('cpu')",
+    )
+    assert status_code == 200
+    assert len({event.ts_id for event in events}) == 1
+    assert states(events) == [("anomalous", 0), ("ok", 1)]
+
+
+@pytest.mark.parametrize("aggregation, by, series", [
+    ("mean", "", 0),
+    ("sum", "", 1),
+    ("max", "", 1),
+    ("min", "", 0),
+    ("mean", "by=['env']", 1),
+    ("sum", "by=['host']", 1),
+    ("count", "", 0),
+])
+def test_aggregation(tmp_path, aggregation, by, series):
+    rows = every_minute("a", [60, 50]) + every_minute("b", [40, 50]) + every_minute("c", [95, 50], env="dev")
+    status_code, events = preflight(
+        tmp_path, rows, f"detect(when(data('cpu').{aggregation}({by}) > 90)).publish('cpu')",
+    )
+    assert status_code == 200
+    assert len({event.ts_id for event in events}) == series
+
+
+@pytest.mark.parametrize("program_text", [
+    "detect(when(data('cpu') > 90), off=when(data('cpu') < 50)).publish('cpu')",
+    "detect(when(data('cpu') > 90, lasting='5m', at_least=0.9)).publish('cpu')",
+    "detect(when(data('cpu').percentile(90) > 90)).publish('cpu')",
+    "detect(when(-filter('host', 'a') > 90)).publish('cpu')",
+    "detect(when(data('cpu') > 90, lasting=5)).publish('cpu')",
+    "detect(when(data('cpu').mean(by=3) > 90)).publish('cpu')",
+    "import os",
+])
+def test_unsupported(tmp_path, program_text):
+    status_code, text = preflight(tmp_path, every_minute("a", [95]), program_text)
+    assert status_code == 400
+    assert "message" in text
+
+
+def test_negative_stream(tmp_path):
+    status_code, events = preflight(
+        tmp_path, every_minute("a", [50, 95]), "detect(when(-data('cpu') < -90)).publish('cpu')",
+    )
+    assert status_code == 200
+    assert states(events) == [("anomalous", 1)]
@@ -1,2 +1,178 @@
-def test_foo():
-    pass
+import pytest
+
+from signalform_tools.preflight import DetectorProgram
+from signalform_tools.preflight import Sweep
+from signalform_tools.preflight import extract_labels
+from signalform_tools.preflight import locate_literal
+from signalform_tools.preflight import parse_sweep
+from signalform_tools.preflight import preflight
+from signalform_tools.preflight import render_events
+from signalform_tools.preflight import replace_literals
+from signalform_tools.preflight import select_detectors
+from signalform_tools.preflight import sweep
+
+
+START = 1577836800
+
+
+def test_preflight_offline_keeps_going(tmp_path, capsys):
+    pytest.importorskip("numpy")
+    from signalform_tools.offline import OfflinePreflight
+
+    path = tmp_path / "metrics.csv"
+    path.write_text("timestamp,metric,value\n" + "".join(
+        f"{START + 60 * minute},cpu,{value}\n" for minute, value in enumerate([40, 60, 60, 40])
+    ))
+    detectors = [
+        DetectorProgram("a", "detect(when(data('cpu').percentile(99) > 50)).publish('a')"),
+        DetectorProgram("b", "detect(when(data('cpu').mean() > 50)).publish('b')"),
+        DetectorProgram("c", "detect(when(data('cpu').percentile(99) > 50)).publish('a')"),
+    ]
+    preflight(detectors, START * 1000, (START + 3600) * 1000, None, OfflinePreflight(str(path)), keep_going=True)
+
+    out = capsys.readouterr().out
+    assert "Detectors: b\nExpected number of triggered alerts: 1\nExpected number of resolved alerts: 1" in out
+    assert "WARNING: 2 detectors could not be preflighted: a, c" in out
+
+
+def test_preflight_stops_on_error(capsys):
+    detectors = [DetectorProgram("a", "detect(when(A > 1))"), DetectorProgram("b", "detect(when(B > 1))")]
+    preflight(detectors, 0, 1000, None, lambda program_text, start, stop: (400, '{"message" : "bad"}'))
+
+    out = capsys.readouterr().out
+    assert "ERROR: Received Response" in out
+    assert "Detectors: b" not in out
+
+
+@pytest.mark.parametrize("parameter, expected", [
+    ("90=80,85, 90", Sweep("90", None, ["80", "85", "90"])),
+    ("5@2=5,10", Sweep("5", 2, ["5", "10"])),
+    ("0.5=0.25,-1e3", Sweep("0.5", None, ["0.25", "-1e3"])),
+])
+def test_parse_sweep(parameter, expected):
+    assert parse_sweep(parameter) == expected
+
+
+@pytest.mark.parametrize("parameter", ["90", "90=", "a=1,2", "90=1,x", "90@=1"])
+def test_parse_sweep_invalid(parameter):
+    with pytest.raises(ValueError):
+        parse_sweep(parameter)
+
+
+def located(program_text, parameter):
+    start, end = locate_literal(program_text, parse_sweep(parameter))
+    return program_text[:start] + "<" + program_text[start:end] + ">" + program_text[end:]
+
+
+@pytest.mark.parametrize("program_text, parameter, expected", [
+    # not within larger numbers
+    ("when(A > 900 or B > 90)", "90=1", "when(A > 900 or B > <90>)"),
+    ("when(A > 190 or B > 90.5 or C > 90)", "90=1", "when(A > 190 or B > 90.5 or C > <90>)"),
+    ("when(A > 90.5)", "90.5=1", "when(A > <90.5>)"),
+    # durations, but not other strings
+    ("when(A > 5, lasting='5m')", "5@2=1", "when(A > 5, lasting='<5>m')"),
+    ("when(A > 1, lasting=\"10ms\")", "10=1", "when(A > 1, lasting=\"<10>ms\")"),
+    ("data('cpu', filter=filter('host', '90')) > 90", "90=1", "data('cpu', filter=filter('host', '90')) > <90>"),
+    # occurrences
+    ("when(A > 90 and B < 90)", "90@1=1", "when(A > <90> and B < 90)"),
+    ("when(A > 90 and B < 90)", "90@2=1", "when(A > 90 and B < <90>)"),
+])
+def test_locate_literal(program_text, parameter, expected):
+    assert located(program_text, parameter) == expected
+
+
+@pytest.mark.parametrize("program_text, parameter, message", [
+    ("when(A > 900)", "90=1", "does not appear"),
+    ("when(A > 90 and B < 90)", "90=1", "appears 2 times"),
+    ("when(A > 90 and B < 90)", "90@3=1", "only appears 2 times"),
+    ("data('cpu', filter=filter('host', '90'))", "90=1", "does not appear"),
+])
+def test_locate_literal_errors(program_text, parameter, message):
+    with pytest.raises(ValueError, match=message):
+        locate_literal(program_text, parse_sweep(parameter))
+
+
+def test_replace_literals_at_once():
+    program_text = "when(A > 90 and B > 9)"
+    positions = [locate_literal(program_text, parse_sweep(parameter)) for parameter in ("90=9", "9=90")]
+    assert replace_literals(program_text, positions, ["9", "90"]) == "when(A > 9 and B > 90)"
+
+
+def test_sweep_two_literals(capsys):
+    program_text = "detect(when(data('cpu').mean() > 90, lasting='5m')).publish('cpu')"
+    sent = []
+
+    def send(program_text, start, stop):
+        sent.append(program_text)
+        return 200, render_events([], start, stop)
+
+    sweep([DetectorProgram("cpu", program_text)], [parse_sweep("90=80,90"), parse_sweep("5=1,5")], 0, 1000,
+          ["cpu"], send)
+    assert sorted(sent) == sorted(
+        f"detect(when(data('cpu').mean() > {threshold}, lasting='{lasting}m')).publish('cpu')"
+        for threshold in ("80", "90") for lasting in ("1", "5")
+    )
+    assert "Sweeping 4 variants" in capsys.readouterr().out
+
+
+def test_sweep_same_literal_twice():
+    program_text = "detect(when(data('cpu').mean() > 90)).publish('cpu')"
+    with pytest.raises(ValueError, match="same literal"):
+        sweep([DetectorProgram("cpu", program_text)], [parse_sweep("90=1"), parse_sweep("90@1=2")], 0, 1000,
+              ["cpu"], lambda *args: (200, ""))
+
+
+@pytest.mark.parametrize("program_text, labels", [
+    ("detect(when(A > 1)).publish('cpu-high')", {"cpu-high"}),
+    ("detect(when(A > 1)).publish(label=\"cpu-high\")", {"cpu-high"}),
+    ("detect(when(A > 1)).publish('high')\ndetect(when(A < 1)).publish('low')", {"high", "low"}),
+    ("# detect(when(A > 1)).publish('old')\ndetect(when(A > 2)).publish('new')", {"new"}),
+    ("detect(when(A > 2)).publish('new')  # was .publish('old')", {"new"}),
+    ("A = data('cpu').publish()", set()),
+])
+def test_extract_labels(program_text, labels):
+    assert extract_labels(program_text) == labels
+
+
+DETECTORS = [
+    DetectorProgram("high", "detect(when(A > 90)).publish('cpu-high')"),
+    DetectorProgram("low", "detect(when(A < 10)).publish('cpu-low')"),
+    DetectorProgram("both", "detect(when(A > 90)).publish('cpu-high')\ndetect(when(A < 10)).publish('cpu-low')"),
+    DetectorProgram("old", "# detect(when(A > 1)).publish('cpu')\ndetect(when(A > 2)).publish('mem')"),
+    DetectorProgram("cpu", "detect(when(A > 1)).publish('cpu')"),
+]
+
+
+def names(detectors):
+    return [detector.name for detector in detectors]
+
+
+@pytest.mark.parametrize("patterns, expected", [
+    # exact labels, not labels they are a prefix of, nor labels only present in comments
+    (["cpu"], ["cpu"]),
+    (["cpu-high"], ["high", "both"]),
+    # glob patterns
+    (["cpu-*"], ["high", "low", "both"]),
+    (["*"], ["high", "low", "both", "old", "cpu"]),
+    # detectors matched by several labels or patterns are selected once
+    (["cpu-high", "cpu-low", "cpu-*"], ["high", "low", "both"]),
+])
+def test_select_detectors(patterns, expected):
+    assert names(select_detectors(DETECTORS, patterns)) == expected
+
+
+def test_select_detectors_warns_unmatched(capsys):
+    assert select_detectors(DETECTORS, ["mem", "disk*"]) == [DETECTORS[3]]
+    assert capsys.readouterr().out == "WARNING: no detector publishes a label matching disk*\n"
+
+
+def test_preflight_labels(capsys):
+    sent = []
+
+    def send(program_text, start, stop):
+        sent.append(program_text)
+        return 200, render_events([], start, stop)
+
+    preflight(DETECTORS, 0, 1000, ["cpu-high"], send)
+    assert sorted(sent) == sorted([DETECTORS[0].program_text, DETECTORS[2].program_text])
+    assert "Detectors: high\n" in capsys.readouterr().out
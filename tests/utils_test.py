@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from signalform_tools.utils import iter_tfstate_resources
+
+
+STATE = {
+    "version": 3,
+    "serial": 12,
+    "modules": [
+        {
+            "path": ["root"],
+            "outputs": {"resources": {"value": "not a resource"}},
+            "resources": {
+                "signalform_detector.cpu": {
+                    "type": "signalform_detector",
+                    "primary": {"id": "x", "attributes": {
+                        "program_text": "detect(when(data('cpu') > 90)).publish('cpu-high') # {\"}[é",
+                    }},
+                },
+                "signalform_time_chart.cpu": {
+                    "type": "signalform_time_chart",
+                    "primary": {"id": "y", "attributes": {"program_text": "data('cpu').publish()", "max": 1.5}},
+                },
+            },
+        },
+        {
+            "path": ["root", "sub"],
+            "resources": {
+                "signalform_detector.sub": {
+                    "type": "signalform_detector",
+                    "primary": {"id": "z", "attributes": {"program_text": "detect(when(data('mem') > 80))"}},
+                },
+            },
+        },
+    ],
+}
+
+
+def chunked(data, size):
+    return (data[start:start + size] for start in range(0, len(data), size))
+
+
+def expected_resources(state):
+    return [resource for module in state["modules"] for resource in module["resources"].items()]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_iter_tfstate_resources(size, indent):
+    data = json.dumps(STATE, indent=indent, ensure_ascii=False).encode("utf-8")
+    assert list(iter_tfstate_resources(chunked(data, size))) == expected_resources(STATE)
+
+
+def test_iter_tfstate_resources_empty_modules():
+    data = json.dumps({"version": 3, "modules": [{"path": ["root"], "resources": {}}]}).encode("utf-8")
+    assert list(iter_tfstate_resources(chunked(data, 5))) == []
+
+
+@pytest.mark.parametrize("cut", [1, 40, -1])
+def test_iter_tfstate_resources_truncated(cut):
+    data = json.dumps(STATE).encode("utf-8")[:cut]
+    with pytest.raises(ValueError):
+        list(iter_tfstate_resources(chunked(data, 16)))
@@ -0,0 +1,208 @@
+import json
+from collections import Counter
+
+import pytest
+
+from signalform_tools import validate
+from signalform_tools.utils import expand_flatmap
+from signalform_tools.validate import SignalFlowResource
+from signalform_tools.validate import ValidationCache
+from signalform_tools.validate import find_violations
+from signalform_tools.validate import register_validation_rule
+from signalform_tools.validate import validate_request
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    monkeypatch.setattr(validate, "validation_cache", ValidationCache(2))
+    return Counter()
+
+
+def chart(name, program_text="data('cpu').publish()"):
+    return SignalFlowResource("signalform_time_chart", name, program_text)
+
+
+def test_name_dependent_rules_are_not_memoized(calls):
+    @register_validation_rule()
+    def validate_team_prefix(resource):
+        calls[resource.name] += 1
+        return None if resource.name.startswith("team_") else "Warning: chart names start with team_"
+
+    assert find_violations(chart("team_a"), [validate_team_prefix]) == []
+    assert find_violations(chart("bad"), [validate_team_prefix]) == ["Warning: chart names start with team_"]
+    assert calls == {"team_a": 1, "bad": 1}
+
+
+def test_memoized_rules_are_shared_by_identical_resources(calls):
+    @register_validation_rule(memoize=True)
+    def validate_publish(resource):
+        calls[resource.program_text] += 1
+        return None if "publish" in resource.program_text else "Warning: nothing published"
+
+    assert find_violations(chart("a"), [validate_publish]) == []
+    assert find_violations(chart("b"), [validate_publish]) == []
+    assert find_violations(chart("c", "data('cpu')"), [validate_publish]) == ["Warning: nothing published"]
+    assert calls == {"data('cpu').publish()": 1, "data('cpu')": 1}
+
+
+def test_validation_cache_evicts_least_recently_used(calls):
+    @register_validation_rule(memoize=True)
+    def validate_anything(resource):
+        calls[resource.program_text] += 1
+        return None
+
+    for program_text in ["A", "B", "A", "C", "A", "B"]:
+        find_violations(chart("x", program_text), [validate_anything])
+    # the cache holds two entries: C evicts B, the least recently used one, and B then evicts C
+    assert calls == {"A": 1, "B": 2, "C": 1}
+    assert len(validate.validation_cache.entries) == 2
+
+
+TF_CONFIG = """
+resource "signalform_time_chart" "c1" {
+  program_text = "data('cpu').mean().publish()"
+}
+
+resource "signalform_detector" "cpu" {
+  program_text = <<-EOF
+    detect(when(data('cpu').mean() > 90, lasting='5m')).publish('CPU too high')
+  EOF
+  rule {
+    detect_label = "CPU too high"
+    runbook_url = "http://runbook"
+  }
+}
+
+resource "signalform_detector" "mem" {
+  max_delay = 30
+  program_text = "detect(when(data('mem').max() > 80).publish('mem high')"
+  rule {
+    detect_label = "mem high"
+  }
+  rule {
+    detect_label = "mem very high"
+  }
+}
+"""
+CHART_ATTRIBUTES = {"program_text": "data('cpu').mean().publish()"}
+CPU_ATTRIBUTES = {
+    "program_text": "detect(when(data('cpu').mean() > 90, lasting='5m')).publish('CPU too high')",
+    "max_delay": None,
+    "rule": [{"detect_label": "CPU too high", "runbook_url": "http://runbook"}],
+}
+MEM_ATTRIBUTES = {
+    "program_text": "detect(when(data('mem').max() > 80).publish('mem high')",
+    "max_delay": 30,
+    "rule": [{"detect_label": "mem high", "runbook_url": ""}, {"detect_label": "mem very high", "runbook_url": ""}],
+}
+V3_STATE = {"version": 3, "modules": [
+    {"path": ["root"], "resources": {
+        "signalform_time_chart.c1": {"type": "signalform_time_chart", "primary": {"attributes": CHART_ATTRIBUTES}},
+        "signalform_detector.cpu": {"type": "signalform_detector", "primary": {"attributes": {
+            "program_text": CPU_ATTRIBUTES["program_text"],
+            "rule.#": "1",
+            "rule.1234.detect_label": "CPU too high",
+            "rule.1234.runbook_url": "http://runbook",
+            "tags.%": "1",
+            "tags.team": "infra",
+        }}},
+        "data.signalform_detector.ignored": {"type": "signalform_detector", "primary": {"attributes": {}}},
+    }},
+    {"path": ["root", "mem"], "resources": {
+        "signalform_detector.mem": {"type": "signalform_detector", "primary": {"attributes": {
+            "program_text": MEM_ATTRIBUTES["program_text"],
+            "max_delay": "30",
+            "rule.#": "2",
+            "rule.1.detect_label": "mem high",
+            "rule.1.runbook_url": "",
+            "rule.2.detect_label": "mem very high",
+        }}},
+    }},
+]}
+V4_STATE = {"version": 4, "resources": [
+    {"mode": "managed", "type": "signalform_time_chart", "name": "c1", "instances": [{"attributes": CHART_ATTRIBUTES}]},
+    {"mode": "managed", "type": "signalform_detector", "name": "cpu", "instances": [{"attributes": CPU_ATTRIBUTES}]},
+    {"mode": "data", "type": "signalform_detector", "name": "ignored", "instances": [{"attributes": {}}]},
+    {"module": "module.mem", "mode": "managed", "type": "signalform_detector", "name": "mem",
+     "instances": [{"attributes": MEM_ATTRIBUTES}]},
+]}
+ROOT_MODULE = {
+    "resources": [
+        {"mode": "managed", "type": "signalform_time_chart", "name": "c1", "values": CHART_ATTRIBUTES},
+        {"mode": "managed", "type": "signalform_detector", "name": "cpu", "values": CPU_ATTRIBUTES},
+        {"mode": "data", "type": "signalform_detector", "name": "ignored", "values": {}},
+    ],
+    "child_modules": [
+        {"resources": [{"mode": "managed", "type": "signalform_detector", "name": "mem", "values": MEM_ATTRIBUTES}]},
+    ],
+}
+
+
+def test_expand_flatmap():
+    assert expand_flatmap({
+        "program_text": "A",
+        "rule.#": "2",
+        "rule.1234.detect_label": "high",
+        "rule.1234.runbook_url": "http://runbook",
+        "rule.5678.detect_label": "low",
+        "tags.%": "1",
+        "tags.team": "infra",
+        "viz_options.#": "0",
+    }) == {
+        "program_text": "A",
+        "rule": [{"detect_label": "high", "runbook_url": "http://runbook"}, {"detect_label": "low"}],
+        "tags": {"team": "infra"},
+        "viz_options": [],
+    }
+
+
+def validate_state(tmp_path, state):
+    path = tmp_path / "state.json"
+    path.write_text(json.dumps(state))
+    return validate_request({"states": [str(path)]})
+
+
+def sorted_warnings(response):
+    return sorted((warning["type"], warning["name"], sorted(warning["violations"])) for warning in response["warnings"])
+
+
+@pytest.mark.parametrize("state", [
+    V3_STATE,
+    V4_STATE,
+    {"format_version": "0.1", "values": {"root_module": ROOT_MODULE}},
+    {"format_version": "0.1", "planned_values": {"root_module": ROOT_MODULE}},
+], ids=["v3", "v4", "show", "plan"])
+def test_states_warn_like_configurations(tmp_path, state):
+    config = tmp_path / "main.tf"
+    config.write_text(TF_CONFIG)
+    expected = validate_request({"paths": [str(config)]})
+    assert expected["errors"] == []
+    assert sorted_warnings(expected) == [
+        ("detector", "cpu", ["Warning: we strongly recommend setting max_delay for detectors"]),
+        ("detector", "mem", [
+            "Warning: detect_label:'mem very high' not in program_text",
+            "Warning: runbook_url is not present for all rules", "Warning: unmatched parentheses in program_text",
+        ]),
+    ]
+
+    response = validate_state(tmp_path, state)
+    assert response["errors"] == []
+    assert sorted_warnings(response) == sorted_warnings(expected)
+
+
+@pytest.mark.parametrize("state, error", [
+    ({"version": 4, "resources": [{"type": "signalform_detector", "name": "cpu",
+                                   "instances": [{"attributes": {"max_delay": 30}}]}]},
+     "Required field 'program_text' missing"),
+    ({"version": 4, "resources": [{"type": "signalform_detector", "name": "cpu",
+                                   "instances": [{"attributes": {"program_text": "A", "rule": ["high"]}}]}]},
+     "unexpected attributes for signalform_detector.cpu"),
+    ({"version": 4, "resources": [{"type": "signalform_detector", "name": "cpu"}]},
+     "unrecognized terraform state or plan format"),
+    ({"serial": 1}, "unrecognized terraform state or plan format"),
+])
+def test_state_errors(tmp_path, state, error):
+    response = validate_state(tmp_path, state)
+    assert response["warnings"] == []
+    assert len(response["errors"]) == 1
+    assert error in response["errors"][0]["error"]